@@ -7,153 +7,48 @@
 
 Quick Rewriter - Minimalist Windows Text Utility
 
-This single-file script provides a borderless prompt window triggered by a
-global hotkey (Ctrl+Shift+Q) to rewrite selected text using OpenRouter.
+This script provides a borderless prompt window triggered by a global
+hotkey (Ctrl+Shift+Q) to rewrite selected text using OpenRouter. The request
+engine itself lives in rewriter_core.py, which has no GUI dependencies.
 """
 
 from __future__ import annotations
 
-import json
+import logging
+import math
 import os
 import threading
 import time
-from typing import Any, Dict, List, Optional
+from typing import Any, Dict, Optional, Tuple
+
+import tkinter
 
 import customtkinter as ctk
 import pyperclip
-import requests
 from pynput.keyboard import Controller, Key, GlobalHotKeys
 
-
-# ----------------------------
-# Constants and file locations
-# ----------------------------
-
-BASE_DIR = os.path.dirname(os.path.abspath(__file__))
-CONFIG_PATH = os.path.join(BASE_DIR, "config.json")
-PROMPTS_PATH = os.path.join(BASE_DIR, "prompts.json")
-
-
-# -----------------
-# Helper Functions
-# -----------------
-
-def load_config() -> Dict[str, Any]:
-    """Load config.json; create with placeholder if missing."""
-    if not os.path.exists(CONFIG_PATH):
-        default = {"api_key": "YOUR_OPENROUTER_API_KEY_HERE"}
-        save_config(default)
-        return default
-    try:
-        with open(CONFIG_PATH, "r", encoding="utf-8") as f:
-            return json.load(f)
-    except Exception:
-        # Reset to default if file is corrupted
-        default = {"api_key": "YOUR_OPENROUTER_API_KEY_HERE"}
-        save_config(default)
-        return default
-
-
-def save_config(data: Dict[str, Any]) -> None:
-    """Persist config to config.json."""
-    with open(CONFIG_PATH, "w", encoding="utf-8") as f:
-        json.dump(data, f, indent=2)
-
-
-def _default_prompts() -> List[Dict[str, str]]:
-    return [
-        {
-            "name": "Professional Tone",
-            "prompt": (
-                "Rewrite the following text in a clear, formal, and professional business tone. "
-                "Output ONLY the rewritten text with no preamble, explanation, or notes:\n\n{text}"
-            ),
-        },
-        {
-            "name": "Fix Grammar",
-            "prompt": (
-                "Correct any spelling and grammar mistakes in the following text. "
-                "Output ONLY the corrected text with no explanations or notes:\n\n{text}"
-            ),
-        },
-    ]
-
-
-def load_prompts() -> List[Dict[str, str]]:
-    """Load prompts.json; create with examples if missing."""
-    if not os.path.exists(PROMPTS_PATH):
-        defaults = _default_prompts()
-        save_prompts(defaults)
-        return defaults
-    try:
-        with open(PROMPTS_PATH, "r", encoding="utf-8") as f:
-            data = json.load(f)
-            if isinstance(data, list):
-                return data
-            return _default_prompts()
-    except Exception:
-        defaults = _default_prompts()
-        save_prompts(defaults)
-        return defaults
-
-
-def save_prompts(data: List[Dict[str, str]]) -> None:
-    """Persist prompts to prompts.json."""
-    with open(PROMPTS_PATH, "w", encoding="utf-8") as f:
-        json.dump(data, f, indent=2, ensure_ascii=False)
-
-
-# --------------
-# API Integration
-# --------------
-
-def _combine_prompt(captured_text: str, instruction_or_template: str) -> str:
-    template = instruction_or_template or ""
-    
-    # Add strict instruction to avoid surrounding text
-    strict_suffix = "\n\nIMPORTANT: Output ONLY the rewritten text. Do not add any explanations, preambles, notes, or surrounding text. Just the result."
-    
-    if "{text}" in template:
-        try:
-            return template.format(text=captured_text) + strict_suffix
-        except Exception:
-            # Fallback to concatenation if formatting fails
-            return f"{template}\n\n{captured_text}" + strict_suffix
-    else:
-        return f"{template.strip()}\n\n{captured_text}".strip() + strict_suffix
-
-
-def call_openrouter_api(captured_text: str, instruction_or_template: str) -> str:
-    """Call OpenRouter with the final prompt and return first choice content."""
-    cfg = load_config()
-    api_key = cfg.get("api_key", "").strip()
-    if not api_key or api_key == "YOUR_OPENROUTER_API_KEY_HERE":
-        raise RuntimeError("OpenRouter API key missing. Set it in Settings (⚙️).")
-
-    final_prompt = _combine_prompt(captured_text, instruction_or_template)
-
-    url = "https://openrouter.ai/api/v1/chat/completions"
-    headers = {
-        "Content-Type": "application/json",
-        "Authorization": f"Bearer {api_key}",
-    }
-    json_data = {
-        "model": "google/gemini-2.5-flash-preview-09-2025",
-        "messages": [
-            {"role": "user", "content": final_prompt},
-        ],
-    }
-
-    response = requests.post(url, headers=headers, json=json_data, timeout=60)
-    response.raise_for_status()
-    data = response.json()
-    choices = data.get("choices", [])
-    if not choices:
-        raise RuntimeError("No choices returned from OpenRouter.")
-    content = choices[0].get("message", {}).get("content", "")
-    if not content:
-        raise RuntimeError("Empty response content from OpenRouter.")
-    return content
+from rewriter_core import (
+    CallLog,
+    DEFAULT_PROFILE_RUNS,
+    LOG_PATH,
+    Rewriter,
+    TraceRecorder,
+    cached_config,
+    cached_prompts,
+    input_size_error,
+    load_config,
+    load_prompts,
+    preflight,
+    profiler,
+    provider_names,
+    recorder,
+    router,
+    save_config_async,
+    save_prompts_async,
+    writer,
+)
+
+logger = logging.getLogger("quick_rewriter")
 
 
 # ---------
@@ -161,6 +56,93 @@ def call_openrouter_api(captured_text: str, instruction_or_template: str) -> str
 # ---------
 
 
+def _callback_name(func: Any) -> str:
+    """Readable name for a Tk callback, looking through the wrapper that after() adds."""
+    code = getattr(func, "__code__", None)
+    if code is not None and code.co_name == "callit" and getattr(func, "__closure__", None):
+        cells = dict(zip(code.co_freevars, func.__closure__))
+        if "func" in cells:
+            func = cells["func"].cell_contents
+    return getattr(func, "__qualname__", None) or type(func).__name__
+
+
+def _format_tokens(n: int) -> str:
+    if n >= 1_000_000:
+        return f"{n / 1_000_000:.1f}M"
+    if n >= 1_000:
+        return f"{n / 1_000:.1f}k"
+    return str(n)
+
+
+class MainLoopWatchdog:
+    """Log Tk main-loop stalls by timing how late periodic after() heartbeats fire.
+
+    While running, every Tk callback is timed (via tkinter.CallWrapper) so a
+    stall can be attributed to the slowest handler since the last heartbeat.
+    """
+
+    def __init__(self, root: Any, interval_ms: int = 100, stall_ms: int = 200):
+        self.root = root
+        self.interval_ms = max(10, int(interval_ms))
+        self.stall_ms = max(1, int(stall_ms))
+        self._expected = 0.0
+        self._job: Optional[str] = None
+        self._slowest: Optional[Tuple[str, float]] = None
+        self._original_call: Any = None
+
+    def start(self) -> None:
+        if self._job is not None:
+            return
+        self._install_callback_timer()
+        self._schedule()
+
+    def stop(self) -> None:
+        if self._job is not None:
+            try:
+                self.root.after_cancel(self._job)
+            except Exception:
+                pass
+            self._job = None
+        if self._original_call is not None:
+            tkinter.CallWrapper.__call__ = self._original_call
+            self._original_call = None
+
+    def _schedule(self) -> None:
+        self._expected = time.perf_counter() + self.interval_ms / 1000
+        self._job = self.root.after(self.interval_ms, self._beat)
+
+    def _beat(self) -> None:
+        drift_ms = (time.perf_counter() - self._expected) * 1000
+        if drift_ms >= self.stall_ms:
+            name, elapsed = self._slowest or ("(no Python handler)", 0.0)
+            logger.warning(
+                "Main loop stalled for %.0f ms; slowest handler: %s (%.0f ms)",
+                drift_ms, name, elapsed * 1000,
+            )
+        self._slowest = None
+        self._schedule()
+
+    def _install_callback_timer(self) -> None:
+        original = tkinter.CallWrapper.__call__
+        self._original_call = original
+        watchdog = self
+
+        def timed_call(wrapper: Any, *args: Any) -> Any:
+            started = time.perf_counter()
+            try:
+                return original(wrapper, *args)
+            finally:
+                elapsed = time.perf_counter() - started
+                slowest = watchdog._slowest
+                if slowest is None or elapsed > slowest[1]:
+                    name = _callback_name(wrapper.func)
+                    if not name.endswith("MainLoopWatchdog._beat"):
+                        watchdog._slowest = (name, elapsed)
+
+        tkinter.CallWrapper.__call__ = timed_call
+
+
+
 class ManagementWindow(ctk.CTkToplevel):
     def __init__(self, master: ctk.CTk):
         super().__init__(master)
@@ -179,8 +161,8 @@ class ManagementWindow(ctk.CTkToplevel):
         # Modern styling
         self.configure(fg_color=("#0f0f0f", "#0f0f0f"))
 
-        self.config_data = load_config()
-        self.prompts = load_prompts()
+        self.config_data = cached_config()
+        self.prompts = cached_prompts()
 
         self._build_ui()
 
@@ -253,6 +235,88 @@ class ManagementWindow(ctk.CTkToplevel):
         )
         api_save_btn.pack(fill="x")
 
+        # Model routing stats card (only once something has been measured)
+        stats_rows = router.summary()
+        if stats_rows:
+            routing_card = ctk.CTkFrame(
+                container,
+                fg_color=("#1a1a1a", "#1a1a1a"),
+                corner_radius=16,
+                border_width=1,
+                border_color=("#2a2a2a", "#2a2a2a")
+            )
+            routing_card.pack(fill="x", pady=(0, 16))
+
+            routing_inner = ctk.CTkFrame(routing_card, fg_color="transparent")
+            routing_inner.pack(fill="x", padx=16, pady=16)
+
+            routing_label = ctk.CTkLabel(
+                routing_inner,
+                text="MODEL ROUTING",
+                font=label_font,
+                text_color=("#6b7280", "#6b7280")
+            )
+            routing_label.pack(anchor="w", pady=(0, 8))
+
+            lines = [f"{'MODEL':<48} {'SIZE':>6} {'LATENCY':>9} {'ERRORS':>7} {'CALLS':>6}"]
+            for key, bucket, st in stats_rows:
+                lines.append(
+                    f"{key.replace('|', ' · ')[:48]:<48} {bucket:>6} {st['latency'] * 1000:>7.0f}ms "
+                    f"{st['error_rate'] * 100:>6.0f}% {int(st['count']):>6}"
+                )
+            routing_stats = ctk.CTkLabel(
+                routing_inner,
+                text="\n".join(lines),
+                font=ctk.CTkFont(family="SF Mono", size=11),
+                text_color=("#ffffff", "#ffffff"),
+                justify="left",
+                anchor="w"
+            )
+            routing_stats.pack(anchor="w")
+
+        # Diagnostics card: on-demand profiling of the next few rewrites
+        diag_card = ctk.CTkFrame(
+            container,
+            fg_color=("#1a1a1a", "#1a1a1a"),
+            corner_radius=16,
+            border_width=1,
+            border_color=("#2a2a2a", "#2a2a2a")
+        )
+        diag_card.pack(fill="x", pady=(0, 16))
+
+        diag_inner = ctk.CTkFrame(diag_card, fg_color="transparent")
+        diag_inner.pack(fill="x", padx=16, pady=16)
+
+        diag_label = ctk.CTkLabel(
+            diag_inner,
+            text="DIAGNOSTICS",
+            font=label_font,
+            text_color=("#6b7280", "#6b7280")
+        )
+        diag_label.pack(anchor="w", pady=(0, 8))
+
+        self._profile_runs = (self.config_data.get("profiling") or {}).get("runs", DEFAULT_PROFILE_RUNS)
+        self.profile_switch = ctk.CTkSwitch(
+            diag_inner,
+            text=f"Profile the next {self._profile_runs} rewrites",
+            font=ctk.CTkFont(family="SF Pro Text", size=13),
+            text_color=("#ffffff", "#ffffff"),
+            progress_color=("#3b82f6", "#3b82f6"),
+            command=self._toggle_profiling
+        )
+        if profiler.remaining:
+            self.profile_switch.select()
+        self.profile_switch.pack(anchor="w")
+
+        self.profile_status = ctk.CTkLabel(
+            diag_inner,
+            text=self._profile_status_text(),
+            font=ctk.CTkFont(family="SF Mono", size=11),
+            text_color=("#6b7280", "#6b7280"),
+            anchor="w"
+        )
+        self.profile_status.pack(anchor="w", pady=(6, 0))
+
         # Prompts section header
         header = ctk.CTkFrame(container, fg_color="transparent")
         header.pack(fill="x", pady=(8, 12))
@@ -291,7 +355,21 @@ class ManagementWindow(ctk.CTkToplevel):
 
     def _save_api_key(self) -> None:
         self.config_data["api_key"] = self.api_entry.get().strip()
-        save_config(self.config_data)
+        save_config_async(self.config_data)
+
+    def _toggle_profiling(self) -> None:
+        if self.profile_switch.get():
+            profiler.arm(self._profile_runs)
+        else:
+            profiler.disarm()
+        self.profile_status.configure(text=self._profile_status_text())
+
+    def _profile_status_text(self) -> str:
+        if profiler.remaining:
+            return f"{profiler.remaining} left · reports in {profiler.session_dir}"
+        if profiler.session_dir:
+            return f"Last reports in {profiler.session_dir}"
+        return "Off"
 
     def _refresh_prompt_list(self) -> None:
         for child in self.list_frame.winfo_children():
@@ -378,13 +456,13 @@ class ManagementWindow(ctk.CTkToplevel):
     def _delete_prompt(self, index: int) -> None:
         if 0 <= index < len(self.prompts):
             del self.prompts[index]
-            save_prompts(self.prompts)
+            save_prompts_async(self.prompts)
             self._refresh_prompt_list()
 
     def _open_prompt_editor(self, index: Optional[int] = None) -> None:
         editor = ctk.CTkToplevel(self)
         editor.title("Edit Prompt" if index is not None else "New Prompt")
-        editor.geometry("680x480")
+        editor.geometry("680x600")
         editor.resizable(False, False)
         editor.configure(fg_color=("#0f0f0f", "#0f0f0f"))
         editor.grab_set()
@@ -444,6 +522,39 @@ class ManagementWindow(ctk.CTkToplevel):
         )
         prompt_text.pack(fill="both", expand=True, pady=(0, 16))
 
+        # Provider field
+        provider_label = ctk.CTkLabel(
+            frame,
+            text="PROVIDER",
+            font=label_font,
+            text_color=("#6b7280", "#6b7280")
+        )
+        provider_label.pack(anchor="w", pady=(0, 6))
+
+        default_choice = "(default)"
+        provider_menu = ctk.CTkOptionMenu(
+            frame,
+            values=[default_choice] + provider_names(self.config_data),
+            height=36,
+            corner_radius=10,
+            fg_color=("#1a1a1a", "#1a1a1a"),
+            button_color=("#2a2a2a", "#2a2a2a"),
+            button_hover_color=("#3a3a3a", "#3a3a3a"),
+            font=ctk.CTkFont(family="SF Pro Text", size=13)
+        )
+        provider_menu.set(default_choice)
+        provider_menu.pack(fill="x", pady=(0, 12))
+
+        # Corrections-only prompts can ask for a short edit list instead of the whole text
+        edits_switch = ctk.CTkSwitch(
+            frame,
+            text="Reply with edits only (faster for small corrections)",
+            font=ctk.CTkFont(family="SF Pro Text", size=13),
+            text_color=("#ffffff", "#ffffff"),
+            progress_color=("#3b82f6", "#3b82f6")
+        )
+        edits_switch.pack(anchor="w", pady=(0, 16))
+
         def save_and_close() -> None:
             name_val = name_entry.get().strip()
             prompt_val = prompt_text.get("1.0", "end").strip()
@@ -455,11 +566,19 @@ class ManagementWindow(ctk.CTkToplevel):
             # If {text} placeholder missing, append it automatically
             if "{text}" not in prompt_val:
                 prompt_val = (prompt_val.rstrip() + "\n\n{text}").strip()
+            entry = {"name": name_val, "prompt": prompt_val}
+            provider_val = provider_menu.get()
+            if provider_val and provider_val != default_choice:
+                entry["provider"] = provider_val
+            if edits_switch.get():
+                entry["output"] = "edits"
             if index is None:
-                self.prompts.append({"name": name_val, "prompt": prompt_val})
+                self.prompts.append(entry)
             else:
-                self.prompts[index] = {"name": name_val, "prompt": prompt_val}
-            save_prompts(self.prompts)
+                # Keep any extra keys (set by hand in prompts.json) other than the edited ones
+                kept = {k: v for k, v in self.prompts[index].items() if k not in ("name", "prompt", "provider", "output")}
+                self.prompts[index] = {**entry, **kept}
+            save_prompts_async(self.prompts)
             self._refresh_prompt_list()
             editor.destroy()
 
@@ -467,6 +586,10 @@ class ManagementWindow(ctk.CTkToplevel):
         if index is not None and 0 <= index < len(self.prompts):
             name_entry.insert(0, self.prompts[index].get("name", ""))
             prompt_text.insert("1.0", self.prompts[index].get("prompt", ""))
+            if self.prompts[index].get("provider"):
+                provider_menu.set(self.prompts[index]["provider"])
+            if self.prompts[index].get("output") == "edits":
+                edits_switch.select()
 
         # Buttons
         buttons = ctk.CTkFrame(frame, fg_color="transparent")
@@ -498,14 +621,20 @@ class ManagementWindow(ctk.CTkToplevel):
 
 
 class PromptWindow(ctk.CTkToplevel):
-    def __init__(self, master: ctk.CTk, captured_text: str, keyboard_controller: Controller, on_done: Optional[callable] = None):
+    def __init__(self, master: ctk.CTk, captured_text: str, keyboard_controller: Controller, rewriter: Rewriter, on_done: Optional[callable] = None, error: Optional[str] = None, trace: Optional[Dict[str, Any]] = None, plan: Optional[Dict[str, Any]] = None):
         super().__init__(master)
+        self.rewriter = rewriter
+        # Trace record for this rewrite when tracing is enabled (see TraceRecorder)
+        self.trace = trace
+        self._shown_at = time.perf_counter()
         self.captured_text = captured_text
         self.on_done = on_done
         self.keyboard_controller = keyboard_controller
         self.prompt_select_mode = False
-        self.prompts = load_prompts()
+        self.prompts = cached_prompts()
         self.name_to_prompt = {p["name"]: p["prompt"] for p in self.prompts}
+        self.name_to_provider = {p["name"]: p.get("provider") for p in self.prompts}
+        self.name_to_output = {p["name"]: p.get("output") for p in self.prompts}
         # Keep an alphabetically sorted list of prompt names for display and navigation
         self.sorted_prompt_names = sorted(self.name_to_prompt.keys(), key=lambda s: s.lower())
         self.selected_prompt_index = 0
@@ -513,6 +642,7 @@ class PromptWindow(ctk.CTkToplevel):
         self._base_height = 70
         self._select_height = 280
         self._paste_executed = False  # Prevent double paste
+        self._screen_size: Optional[Tuple[int, int]] = None
 
         self.overrideredirect(True)
         # Removed -topmost so window doesn't stay above everything
@@ -525,10 +655,20 @@ class PromptWindow(ctk.CTkToplevel):
         self.bind("<Escape>", self._cancel)
         self.bind("<Return>", self._submit)
 
+        # Request size estimate and what preflight will do with it, before anything is sent
+        if plan and not error:
+            self._show_token_estimate(plan)
+
+        # Selection was rejected up front (e.g. too large); show why and close
+        if error:
+            self._disable_inputs()
+            self._finish_error(error)
+
     def _center_geometry(self, width: int, height: int) -> str:
-        self.update_idletasks()
-        screen_w = self.winfo_screenwidth()
-        screen_h = self.winfo_screenheight()
+        # Screen size needs no pending layout work, so skip update_idletasks()
+        if self._screen_size is None:
+            self._screen_size = (self.winfo_screenwidth(), self.winfo_screenheight())
+        screen_w, screen_h = self._screen_size
         x = int((screen_w - width) / 2)
         y = int((screen_h - height) / 2)
         return f"{width}x{height}+{x}+{y}"
@@ -626,6 +766,8 @@ class PromptWindow(ctk.CTkToplevel):
         # Clear any existing buttons
         for child in self.prompts_list_frame.winfo_children():
             child.destroy()
+        self.prompt_buttons = []
+        self._highlighted_index: Optional[int] = None
 
         prompt_names = list(self.sorted_prompt_names)
         button_font = ctk.CTkFont(family="SF Pro Text", size=13)
@@ -651,18 +793,17 @@ class PromptWindow(ctk.CTkToplevel):
             self._highlight_prompt(0)
 
     def _highlight_prompt(self, index: int) -> None:
-        """Highlight the selected prompt button."""
-        for i, btn in enumerate(self.prompt_buttons):
-            if i == index:
-                btn.configure(
-                    fg_color=("#3b82f6", "#3b82f6"),
-                    text_color=("#ffffff", "#ffffff")
-                )
-            else:
-                btn.configure(
-                    fg_color="transparent",
-                    text_color=("#ffffff", "#ffffff")
-                )
+        """Highlight the selected prompt button, restyling only the two that change."""
+        previous = self._highlighted_index
+        if previous == index:
+            return
+        if previous is not None and 0 <= previous < len(self.prompt_buttons):
+            self.prompt_buttons[previous].configure(fg_color="transparent")
+        if 0 <= index < len(self.prompt_buttons):
+            self.prompt_buttons[index].configure(fg_color=("#3b82f6", "#3b82f6"))
+            self._highlighted_index = index
+        else:
+            self._highlighted_index = None
 
     def _select_prompt(self, index: int) -> None:
         """Select a prompt by index."""
@@ -752,13 +893,18 @@ class PromptWindow(ctk.CTkToplevel):
         self.destroy()
 
     def _submit(self, _event=None) -> None:
+        provider_name = None
+        output = None
+        selected_name = "(custom)"
         if self.prompt_select_mode:
-            # Get selected prompt from list by index
-            prompt_names = list(self.name_to_prompt.keys())
+            # Get selected prompt from list by index (same order as displayed)
+            prompt_names = self.sorted_prompt_names
             if 0 <= self.selected_prompt_index < len(prompt_names):
                 selected_name = prompt_names[self.selected_prompt_index]
                 template = self.name_to_prompt.get(selected_name, "")
                 instruction = template
+                provider_name = self.name_to_provider.get(selected_name)
+                output = self.name_to_output.get(selected_name)
             else:
                 return
         else:
@@ -770,21 +916,48 @@ class PromptWindow(ctk.CTkToplevel):
         self._disable_inputs()
         self._pulse_status()
 
+        trace = self.trace
+        if trace is not None:
+            trace["think_ms"] = round((time.perf_counter() - self._shown_at) * 1000, 1)
+            trace["prompt"] = selected_name
+            trace["instruction_chars"] = len(instruction)
+
         def worker():
+            started = time.perf_counter()
+            calls = CallLog()
             try:
-                result = call_openrouter_api(self.captured_text, instruction)
+                result = self.rewriter.rewrite(
+                    self.captured_text, instruction, provider=provider_name, output=output, calls=calls
+                )
+                rewrite_done = time.perf_counter()
+                if trace is not None:
+                    trace["response_chars"] = len(result)
                 pyperclip.copy(result)
+                del result  # Clipboard owns the text now; don't hold a second copy while pasting
+                if trace is not None:
+                    trace["ok"] = True
+                    trace["rewrite_ms"] = round((rewrite_done - started) * 1000, 1)
+                    trace["clipboard_ms"] = round((time.perf_counter() - rewrite_done) * 1000, 1)
                 # Schedule window close on main thread
                 self.after(0, self._finish_success)
                 # Auto-paste in background after window closes
                 time.sleep(0.25)  # Wait for window to close and focus to restore
                 self._auto_paste()
             except Exception as e:
-                msg = f"Error: {e}"
-                pyperclip.copy(msg)
-                self.after(0, lambda: self._finish_error(str(e)))
-
-        threading.Thread(target=worker, daemon=True).start()
+                if trace is not None:
+                    trace["ok"] = False
+                    trace["error"] = type(e).__name__
+                    trace["rewrite_ms"] = round((time.perf_counter() - started) * 1000, 1)
+                err = str(e)  # `e` is unbound once the except block ends
+                pyperclip.copy(f"Error: {err}")
+                self.after(0, lambda: self._finish_error(err))
+            finally:
+                if trace is not None:
+                    # Totals over every provider call, including chunks and paragraphs sent from worker threads
+                    trace.update(calls.summary())
+                    recorder.record(trace)
+
+        threading.Thread(target=worker, name="rewrite-worker", daemon=True).start()
 
     def _disable_inputs(self) -> None:
         try:
@@ -797,6 +970,20 @@ class PromptWindow(ctk.CTkToplevel):
         except Exception:
             pass
 
+    def _show_token_estimate(self, plan: Dict[str, Any]) -> None:
+        text = f"≈{_format_tokens(plan['tokens'])} tokens / {_format_tokens(plan['limit'])}"
+        color = ("#6b7280", "#6b7280")
+        if plan["action"] == "switch":
+            text += f" · will use {plan['model']}"
+            color = ("#fbbf24", "#fbbf24")
+        elif plan["action"] == "chunk":
+            text += f" · will be sent in ~{math.ceil(plan['tokens'] / plan['chunk_tokens'])} parts"
+            color = ("#fbbf24", "#fbbf24")
+        elif plan["action"] == "reject":
+            text += " · too large for the model"
+            color = ("#ef4444", "#ef4444")
+        self.status_label.configure(text=text, text_color=color)
+
     def _set_status(self, text: str) -> None:
         self.status_label.configure(text=text)
 
@@ -861,26 +1048,68 @@ class App(ctk.CTk):
         self.title("Quick Rewriter")
         self.protocol("WM_DELETE_WINDOW", self._on_close)
 
-        # Preload or create data files
-        load_config()
+        # Preload or create data files (this also fills the caches the UI reads from)
+        cfg = load_config()
         load_prompts()
+        router.load()
+
+        watchdog_cfg = cfg.get("watchdog") or {}
+        self.watchdog: Optional[MainLoopWatchdog] = None
+        if watchdog_cfg.get("enabled", True):
+            self.watchdog = MainLoopWatchdog(
+                self,
+                interval_ms=watchdog_cfg.get("interval_ms", 100),
+                stall_ms=watchdog_cfg.get("stall_ms", 200),
+            )
+            self.watchdog.start()
 
+        self.rewriter = Rewriter()
         self.keyboard_controller = Controller()
         self.current_prompt_window: Optional[PromptWindow] = None
         self._start_hotkey_listener()
 
+        # QUICK_REWRITER_PROFILE=N profiles the first N rewrites of this run
+        profile_runs = os.environ.get("QUICK_REWRITER_PROFILE", "").strip()
+        if profile_runs.isdigit() and int(profile_runs) > 0:
+            profiler.arm(int(profile_runs))
+
     def _start_hotkey_listener(self) -> None:
         self.listener = GlobalHotKeys({
             '<ctrl>+<shift>+q': self._on_hotkey,
+            # Hidden: profile the next few rewrites
+            '<ctrl>+<shift>+<alt>+p': self._on_profile_hotkey,
         })
         self.listener.start()
 
+    def _on_profile_hotkey(self) -> None:
+        # Runs in listener thread
+        runs = (load_config().get("profiling") or {}).get("runs", DEFAULT_PROFILE_RUNS)
+        profiler.arm(runs)
+
     def _on_hotkey(self) -> None:
         # Runs in listener thread
+        started = time.perf_counter()
         captured = self._capture_selected_text()
         if not captured:
             return
-        self.after(0, lambda: self._open_prompt_window(captured))
+        cfg = load_config()
+        # Pick up hand edits to prompts.json; the prompt window reads the refreshed cache
+        load_prompts()
+        too_large = input_size_error(len(captured), cfg)
+        if too_large:
+            # Don't hand the oversized selection to the UI at all
+            self.after(0, lambda: self._open_prompt_window("", error=too_large))
+            return
+        trace = None
+        if TraceRecorder.enabled(cfg):
+            trace = recorder.start((time.perf_counter() - started) * 1000, len(captured))
+        # Plan here, off the Tk thread, with the default provider (or routing candidates);
+        # the token estimate is cached for the check made when the rewrite is sent
+        try:
+            plan: Optional[Dict[str, Any]] = preflight(captured, "", None, cfg)
+        except RuntimeError:
+            plan = None
+        self.after(0, lambda: self._open_prompt_window(captured, trace=trace, plan=plan))
 
     def _capture_selected_text(self) -> str:
         try:
@@ -901,7 +1130,13 @@ class App(ctk.CTk):
         except Exception:
             return ""
 
-    def _open_prompt_window(self, captured_text: str) -> None:
+    def _open_prompt_window(
+        self,
+        captured_text: str,
+        error: Optional[str] = None,
+        trace: Optional[Dict[str, Any]] = None,
+        plan: Optional[Dict[str, Any]] = None,
+    ) -> None:
         if self.current_prompt_window and self.current_prompt_window.winfo_exists():
             try:
                 self.current_prompt_window.lift()
@@ -913,7 +1148,10 @@ class App(ctk.CTk):
         def on_done() -> None:
             self.current_prompt_window = None
 
-        self.current_prompt_window = PromptWindow(self, captured_text, self.keyboard_controller, on_done=on_done)
+        self.current_prompt_window = PromptWindow(
+            self, captured_text, self.keyboard_controller, self.rewriter,
+            on_done=on_done, error=error, trace=trace, plan=plan
+        )
         self.current_prompt_window.lift()
         self.current_prompt_window.focus_force()
 
@@ -925,10 +1163,18 @@ class App(ctk.CTk):
             self.listener.stop()
         except Exception:
             pass
+        if self.watchdog:
+            self.watchdog.stop()
+        writer.flush()
         self.destroy()
 
 
 def main() -> None:
+    logging.basicConfig(
+        filename=LOG_PATH,
+        level=logging.INFO,
+        format="%(asctime)s %(levelname)s %(threadName)s %(name)s: %(message)s",
+    )
     ctk.set_appearance_mode("dark")
     ctk.set_default_color_theme("blue")
 
@@ -0,0 +1,249 @@
+"""
+Replay recorded rewrite traces against a local mock provider.
+
+Traces are written by Quick Rewriter when "tracing" is enabled in
+config.json (see TraceRecorder). Each simulated user walks the trace in
+order, waiting the recorded inter-arrival gap (divided by --speed) before
+sending a synthetic request of the recorded size. The mock provider is an
+OpenAI-compatible /chat/completions endpoint whose latency follows a simple
+time-to-first-byte plus throughput model.
+
+By default requests go straight to call_openrouter_api. With --engine
+rewriter they go through one shared Rewriter, so the result cache,
+routing, preflight chunking and incremental batching are exercised too.
+
+    python replay_traces.py traces/trace-20261018.jsonl --speed 10 --users 50
+    python replay_traces.py traces/trace-20261018.jsonl --users 50 --engine rewriter
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Optional, Tuple
+
+from rewriter_core import Rewriter, call_openrouter_api
+
+
+# -------------
+# Mock Provider
+# -------------
+
+class MockProviderHandler(BaseHTTPRequestHandler):
+    """OpenAI-compatible chat endpoint.
+
+    The reply length comes from the model name ("mock-<chars>"); for any
+    other model it matches the length of the last message.
+    """
+
+    ttfb: float = 0.3
+    chars_per_sec: float = 2000.0
+
+    def do_POST(self) -> None:
+        body = self._read_body()
+        try:
+            payload = json.loads(body)
+            model = str(payload.get("model", "mock"))
+            last_content = payload["messages"][-1].get("content")
+        except Exception:
+            self.send_error(400, "Invalid JSON")
+            return
+
+        if model.startswith("mock-") and model[5:].isdigit():
+            reply_chars = int(model[5:])
+        else:
+            reply_chars = len(last_content) if isinstance(last_content, str) else 0
+        reply_chars = max(1, reply_chars)
+        time.sleep(self.ttfb + reply_chars / self.chars_per_sec)
+
+        response = json.dumps({
+            "model": model,
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": "x" * reply_chars}}],
+            "usage": {"prompt_tokens": len(body) // 4, "completion_tokens": reply_chars // 4},
+        }).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(response)))
+        self.end_headers()
+        self.wfile.write(response)
+
+    def _read_body(self) -> bytes:
+        # Large requests are sent with chunked transfer encoding
+        if self.headers.get("Transfer-Encoding", "").lower() == "chunked":
+            parts = []
+            while True:
+                size = int(self.rfile.readline().split(b";")[0].strip() or b"0", 16)
+                if size == 0:
+                    while self.rfile.readline().strip():
+                        pass
+                    break
+                parts.append(self.rfile.read(size))
+                self.rfile.readline()
+            return b"".join(parts)
+        return self.rfile.read(int(self.headers.get("Content-Length", 0)))
+
+    def log_message(self, format: str, *args: Any) -> None:
+        pass  # Keep replay output readable
+
+
+class MockProviderServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 256  # Many simulated users connect at once
+
+
+def start_mock_provider(ttfb: float, chars_per_sec: float, host: str = "127.0.0.1", port: int = 0) -> MockProviderServer:
+    handler = type("ConfiguredMockHandler", (MockProviderHandler,), {"ttfb": ttfb, "chars_per_sec": chars_per_sec})
+    server = MockProviderServer((host, port), handler)
+    threading.Thread(target=server.serve_forever, name="mock-provider", daemon=True).start()
+    return server
+
+
+# ------
+# Replay
+# ------
+
+def load_traces(paths: List[str]) -> List[Dict[str, Any]]:
+    traces = []
+    for path in paths:
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    traces.append(json.loads(line))
+                except json.JSONDecodeError:
+                    continue
+    return traces
+
+
+def _replay_user(
+    user: int,
+    traces: List[Dict[str, Any]],
+    cfg: Dict[str, Any],
+    speed: float,
+    max_gap: float,
+    results: List[Tuple[float, bool]],
+    lock: threading.Lock,
+    rewriter: Optional[Rewriter] = None,
+) -> None:
+    # Start each user at a different point in the trace so bursts don't line up
+    offset = random.randrange(len(traces)) if user else 0
+    for i in range(len(traces)):
+        trace = traces[(offset + i) % len(traces)]
+        gap = min(float(trace.get("gap_s") or 0.0), max_gap)
+        time.sleep(gap / speed)
+
+        n_chars = int(trace.get("input_chars", 0))
+        # Distinct per user and request, so the Rewriter's result cache isn't hit unrealistically
+        text = (f"[{user}:{i}] " + "lorem ipsum " * (n_chars // 12 + 1))[:n_chars]
+        instruction = "r" * int(trace.get("instruction_chars", 0)) + "\n\n{text}"
+        model = f"mock-{int(trace.get('response_chars') or len(text))}"
+        started = time.perf_counter()
+        try:
+            if rewriter is not None:
+                rewriter.rewrite(text, instruction, provider="mock")
+            else:
+                call_openrouter_api(text, instruction, "mock", model, cfg)
+            ok = True
+        except Exception:
+            ok = False
+        with lock:
+            results.append((time.perf_counter() - started, ok))
+
+
+def _percentile(sorted_values: List[float], pct: float) -> float:
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(pct / 100 * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def replay(
+    traces: List[Dict[str, Any]],
+    speed: float,
+    users: int,
+    max_gap: float,
+    base_url: str,
+    engine: str = "direct",
+) -> Dict[str, Any]:
+    cfg = {
+        "providers": {"mock": {"base_url": base_url, "model": "mock", "timeout": 300, "pool_size": users}},
+        "max_input_chars": 0,
+    }
+    rewriter = Rewriter(cfg=cfg, prompts=[]) if engine == "rewriter" else None
+    results: List[Tuple[float, bool]] = []
+    lock = threading.Lock()
+    threads = [
+        threading.Thread(
+            target=_replay_user, args=(u, traces, cfg, speed, max_gap, results, lock, rewriter), name=f"user-{u}"
+        )
+        for u in range(users)
+    ]
+    started = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    wall = time.perf_counter() - started
+
+    latencies = sorted(lat for lat, _ in results)
+    summary = {
+        "requests": len(results),
+        "errors": sum(1 for _, ok in results if not ok),
+        "wall_s": wall,
+        "throughput_rps": len(results) / wall if wall else 0.0,
+        "p50_ms": _percentile(latencies, 50) * 1000,
+        "p90_ms": _percentile(latencies, 90) * 1000,
+        "p99_ms": _percentile(latencies, 99) * 1000,
+        "max_ms": (latencies[-1] if latencies else 0.0) * 1000,
+    }
+    if rewriter is not None:
+        summary["rewriter"] = rewriter.metrics()
+    return summary
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="Replay Quick Rewriter traces against a local mock provider.")
+    parser.add_argument("traces", nargs="+", help="trace-*.jsonl files written by the trace recorder")
+    parser.add_argument("--speed", type=float, default=1.0, help="time compression factor, e.g. 1, 10, 100")
+    parser.add_argument("--users", type=int, default=1, help="number of simulated concurrent users")
+    parser.add_argument("--max-gap", type=float, default=600.0, help="cap on a single inter-arrival gap in seconds")
+    parser.add_argument("--ttfb-ms", type=float, default=300.0, help="mock provider time to first byte")
+    parser.add_argument("--chars-per-sec", type=float, default=2000.0, help="mock provider output throughput")
+    parser.add_argument("--engine", choices=("direct", "rewriter"), default="direct",
+                        help="send requests directly or through a shared Rewriter")
+    args = parser.parse_args(argv)
+
+    traces = load_traces(args.traces)
+    if not traces:
+        parser.error("no trace records found")
+
+    server = start_mock_provider(args.ttfb_ms / 1000, args.chars_per_sec)
+    try:
+        base_url = f"http://127.0.0.1:{server.server_address[1]}/v1"
+        print(f"Replaying {len(traces)} trace records x {args.users} user(s) at {args.speed:g}x against {base_url}")
+        summary = replay(traces, max(args.speed, 1e-6), max(1, args.users), args.max_gap, base_url, args.engine)
+    finally:
+        server.shutdown()
+
+    print(
+        f"{summary['requests']} requests, {summary['errors']} errors in {summary['wall_s']:.1f}s "
+        f"({summary['throughput_rps']:.1f} req/s)\n"
+        f"latency p50 {summary['p50_ms']:.0f} ms  p90 {summary['p90_ms']:.0f} ms  "
+        f"p99 {summary['p99_ms']:.0f} ms  max {summary['max_ms']:.0f} ms"
+    )
+    if "rewriter" in summary:
+        m = summary["rewriter"]
+        print(
+            f"rewriter: {m['requests']:.0f} requests, {m['errors']:.0f} errors, {m['cache_hits']:.0f} cache hits, "
+            f"avg {m['avg_latency_s'] * 1000:.0f} ms"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,245 @@
+"""
+Local HTTP rewrite service for other tools, using the same prompt library.
+
+Serves the rewriter_core engine as a small JSON API on localhost:
+
+    POST /v1/rewrite   {"text": ..., "instruction": ...}  or  {"text": ..., "prompt": "Fix Grammar"}
+                       optional "provider" and "output" ("text" or "edits"); returns {"text": ...}
+    GET  /v1/prompts   quick prompt names
+    GET  /v1/metrics   rewriter and batching counters
+    GET  /health
+
+Errors: 400 for a malformed request, 404 for an unknown prompt, 413 for text
+over the size cap or too large for any model, 502 when the provider fails.
+
+Requests are handled concurrently. With a batching window set, short texts
+that share the same instruction and provider are packed into one delimited
+model request and the reply is split back per item.
+
+    python rewrite_server.py --port 8765 --batch-window-ms 25
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import logging
+import threading
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Optional, Tuple
+
+from rewriter_core import InputTooLarge, Rewriter, can_batch, load_config, pack_batch, split_batch_reply
+
+logger = logging.getLogger("rewrite_server")
+
+DEFAULT_PORT = 8765
+
+
+# --------------
+# Micro-batching
+# --------------
+
+class _Batch:
+    def __init__(self) -> None:
+        self.items: List[Tuple[str, Future]] = []
+
+
+class MicroBatcher:
+    """Coalesce short texts with the same instruction and provider into one model request.
+
+    The first item of a batch starts a window timer; the batch is sent when
+    the window closes or it reaches max_items. If the reply cannot be split
+    back into exactly one result per item, each caller rewrites its own text.
+    """
+
+    def __init__(self, rewriter: Rewriter, window_ms: float, max_items: int = 16, max_chars: int = 400):
+        self.rewriter = rewriter
+        self.window_s = max(0.0, window_ms) / 1000
+        self.max_items = max(2, max_items)
+        self.max_chars = max_chars
+        self._pending: Dict[Tuple[str, str], _Batch] = {}
+        self._lock = threading.Lock()
+        self.stats = {"batches": 0, "batched_items": 0, "fallbacks": 0}
+
+    def eligible(self, text: str) -> bool:
+        return self.window_s > 0 and len(text) <= self.max_chars and can_batch(text)
+
+    def rewrite(self, text: str, instruction: str, provider: Optional[str] = None, output: Optional[str] = None) -> str:
+        # Edit lists can't be packed, so edit-mode requests always go on their own
+        if output == "edits" or not self.eligible(text):
+            return self.rewriter.rewrite(text, instruction, provider=provider, output=output)
+
+        key = (instruction, provider or "")
+        future: Future = Future()
+        full_batch = None
+        with self._lock:
+            batch = self._pending.get(key)
+            if batch is None:
+                batch = self._pending[key] = _Batch()
+                timer = threading.Timer(self.window_s, self._flush, (key, batch))
+                timer.daemon = True
+                timer.start()
+            batch.items.append((text, future))
+            if len(batch.items) >= self.max_items:
+                full_batch = self._pending.pop(key)
+        if full_batch is not None:
+            self._send(key, full_batch)
+
+        result = future.result()
+        if result is None:
+            # Batch reply could not be split; rewrite this item on its own
+            return self.rewriter.rewrite(text, instruction, provider=provider)
+        return result
+
+    def _flush(self, key: Tuple[str, str], batch: _Batch) -> None:
+        with self._lock:
+            # The batch may already have been sent because it filled up
+            if self._pending.get(key) is not batch:
+                return
+            del self._pending[key]
+        self._send(key, batch)
+
+    def _send(self, key: Tuple[str, str], batch: _Batch) -> None:
+        instruction, provider = key
+        items = batch.items
+        if len(items) == 1:
+            # Nothing to pack; let the caller make the plain request
+            items[0][1].set_result(None)
+            return
+
+        combined, batch_instruction = pack_batch([text for text, _ in items], instruction)
+        try:
+            reply = self.rewriter.rewrite(combined, batch_instruction, provider=provider or None, incremental=False)
+        except Exception as e:
+            for _, future in items:
+                future.set_exception(e)
+            return
+
+        results = split_batch_reply(reply, len(items))
+        with self._lock:
+            self.stats["batches"] += 1
+            self.stats["batched_items"] += len(items)
+            if results is None:
+                self.stats["fallbacks"] += 1
+        if results is None:
+            logger.warning("Batch reply for %d items could not be split; falling back", len(items))
+            for _, future in items:
+                future.set_result(None)
+            return
+        for (_, future), result in zip(items, results):
+            future.set_result(result)
+
+
+# ------------
+# HTTP Service
+# ------------
+
+class RewriteRequestHandler(BaseHTTPRequestHandler):
+    rewriter: Rewriter
+    batcher: MicroBatcher
+
+    def do_GET(self) -> None:
+        if self.path == "/health":
+            self._send_json(200, {"status": "ok"})
+        elif self.path == "/v1/prompts":
+            self._send_json(200, {"prompts": [p.get("name") for p in self.rewriter.prompts()]})
+        elif self.path == "/v1/metrics":
+            self._send_json(200, {**self.rewriter.metrics(), **self.batcher.stats})
+        else:
+            self._send_json(404, {"error": "Not found"})
+
+    def do_POST(self) -> None:
+        if self.path != "/v1/rewrite":
+            self._send_json(404, {"error": "Not found"})
+            return
+        try:
+            payload = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+        except Exception:
+            self._send_json(400, {"error": "Body must be JSON."})
+            return
+        if not isinstance(payload, dict) or not isinstance(payload.get("text"), str):
+            self._send_json(400, {"error": "\"text\" (string) is required."})
+            return
+
+        text = payload["text"]
+        provider = payload.get("provider")
+        instruction = payload.get("instruction")
+        output = payload.get("output")
+        try:
+            if payload.get("prompt") is not None:
+                p = self.rewriter.prompt(str(payload["prompt"]))
+                instruction = p.get("prompt", "")
+                provider = provider or p.get("provider")
+                output = output or p.get("output")
+            if not instruction:
+                self._send_json(400, {"error": "Give either \"instruction\" or \"prompt\"."})
+                return
+            result = self.batcher.rewrite(text, str(instruction), provider, output)
+        except KeyError as e:
+            self._send_json(404, {"error": str(e).strip("'\"")})
+            return
+        except InputTooLarge as e:
+            self._send_json(413, {"error": str(e)})
+            return
+        except Exception as e:
+            self._send_json(502, {"error": str(e)})
+            return
+        self._send_json(200, {"text": result})
+
+    def _send_json(self, status: int, data: Dict[str, Any]) -> None:
+        body = json.dumps(data, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format: str, *args: Any) -> None:
+        logger.info("%s - %s", self.address_string(), format % args)
+
+
+class RewriteServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+
+def make_server(
+    rewriter: Rewriter,
+    host: str = "127.0.0.1",
+    port: int = DEFAULT_PORT,
+    batch_window_ms: float = 0.0,
+    batch_max_items: int = 16,
+    batch_max_chars: int = 400,
+) -> RewriteServer:
+    batcher = MicroBatcher(rewriter, batch_window_ms, batch_max_items, batch_max_chars)
+    handler = type("ConfiguredRewriteHandler", (RewriteRequestHandler,), {"rewriter": rewriter, "batcher": batcher})
+    return RewriteServer((host, port), handler)
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    server_cfg = load_config().get("server") or {}
+    parser = argparse.ArgumentParser(description="Serve Quick Rewriter prompts over a localhost JSON API.")
+    parser.add_argument("--host", default=server_cfg.get("host", "127.0.0.1"))
+    parser.add_argument("--port", type=int, default=server_cfg.get("port", DEFAULT_PORT))
+    parser.add_argument("--batch-window-ms", type=float, default=server_cfg.get("batch_window_ms", 0.0),
+                        help="micro-batching window; 0 disables batching")
+    parser.add_argument("--batch-max-items", type=int, default=server_cfg.get("batch_max_items", 16))
+    parser.add_argument("--batch-max-chars", type=int, default=server_cfg.get("batch_max_chars", 400),
+                        help="only texts up to this length are batched")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+    server = make_server(
+        Rewriter(), args.host, args.port, args.batch_window_ms, args.batch_max_items, args.batch_max_chars
+    )
+    logger.info("Listening on http://%s:%d", *server.server_address[:2])
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
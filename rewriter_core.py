@@ -0,0 +1,1613 @@
+"""
+Rewriter core - the GUI-free request engine behind Quick Rewriter.
+
+Prompts, provider backends, model routing, result caching, metrics and
+diagnostics live here so services and scripts can rewrite text without
+importing customtkinter or pynput. requests and the profiling modules are
+imported on first use to keep ``import rewriter_core`` cheap.
+"""
+
+from __future__ import annotations
+
+import copy
+import hashlib
+import io
+import json
+import logging
+import math
+import os
+import queue
+import random
+import re
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter, OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import TYPE_CHECKING, Any, Dict, Iterator, List, Optional, Tuple
+
+if TYPE_CHECKING:
+    import cProfile
+
+    import requests
+
+
+# ----------------------------
+# Constants and file locations
+# ----------------------------
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+CONFIG_PATH = os.path.join(BASE_DIR, "config.json")
+PROMPTS_PATH = os.path.join(BASE_DIR, "prompts.json")
+ROUTER_STATS_PATH = os.path.join(BASE_DIR, "router_stats.json")
+LOG_PATH = os.path.join(BASE_DIR, "quick_rewriter.log")
+PROFILES_DIR = os.path.join(BASE_DIR, "profiles")
+TRACES_DIR = os.path.join(BASE_DIR, "traces")
+
+logger = logging.getLogger("rewriter_core")
+
+
+# -----------------
+# Helper Functions
+# -----------------
+
+# Last loaded/saved contents, so the Tk thread never has to read from disk
+_config_cache: Optional[Dict[str, Any]] = None
+_prompts_cache: Optional[List[Dict[str, str]]] = None
+# Async saves not yet on disk; while any are queued the cache is newer than the file
+_pending_writes: Counter = Counter()
+_cache_lock = threading.Lock()
+
+
+def _replace_json(path: str, data: Any, **dump_args: Any) -> None:
+    """Write JSON to a temp file and swap it in, so readers never see a half-written file."""
+    tmp_path = f"{path}.{threading.get_ident()}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(data, f, **dump_args)
+    for attempt in range(5):
+        try:
+            os.replace(tmp_path, path)
+            return
+        except PermissionError:
+            # Windows refuses while another thread has the file open for reading
+            if attempt == 4:
+                raise
+            time.sleep(0.05)
+
+
+def load_config() -> Dict[str, Any]:
+    """Load config.json; create with placeholder if missing."""
+    global _config_cache
+    with _cache_lock:
+        if _pending_writes["config"] and _config_cache is not None:
+            return copy.deepcopy(_config_cache)
+    if not os.path.exists(CONFIG_PATH):
+        default = {"api_key": "YOUR_OPENROUTER_API_KEY_HERE"}
+        save_config(default)
+        return default
+    try:
+        with open(CONFIG_PATH, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        with _cache_lock:
+            if _pending_writes["config"] and _config_cache is not None:
+                return copy.deepcopy(_config_cache)
+            _config_cache = copy.deepcopy(data)
+        return data
+    except Exception:
+        # Reset to default if file is corrupted
+        default = {"api_key": "YOUR_OPENROUTER_API_KEY_HERE"}
+        save_config(default)
+        return default
+
+
+def save_config(data: Dict[str, Any]) -> None:
+    """Persist config to config.json."""
+    global _config_cache
+    with _cache_lock:
+        _config_cache = copy.deepcopy(data)
+    _write_config(data)
+
+
+def _write_config(data: Dict[str, Any]) -> None:
+    _replace_json(CONFIG_PATH, data, indent=2)
+
+
+def _default_prompts() -> List[Dict[str, str]]:
+    return [
+        {
+            "name": "Professional Tone",
+            "prompt": (
+                "Rewrite the following text in a clear, formal, and professional business tone. "
+                "Output ONLY the rewritten text with no preamble, explanation, or notes:\n\n{text}"
+            ),
+        },
+        {
+            "name": "Fix Grammar",
+            "prompt": (
+                "Correct any spelling and grammar mistakes in the following text. "
+                "Output ONLY the corrected text with no explanations or notes:\n\n{text}"
+            ),
+        },
+    ]
+
+
+def load_prompts() -> List[Dict[str, str]]:
+    """Load prompts.json; create with examples if missing."""
+    global _prompts_cache
+    with _cache_lock:
+        if _pending_writes["prompts"] and _prompts_cache is not None:
+            return copy.deepcopy(_prompts_cache)
+    if not os.path.exists(PROMPTS_PATH):
+        defaults = _default_prompts()
+        save_prompts(defaults)
+        return defaults
+    try:
+        with open(PROMPTS_PATH, "r", encoding="utf-8") as f:
+            data = json.load(f)
+            if isinstance(data, list):
+                with _cache_lock:
+                    if _pending_writes["prompts"] and _prompts_cache is not None:
+                        return copy.deepcopy(_prompts_cache)
+                    _prompts_cache = copy.deepcopy(data)
+                return data
+            return _default_prompts()
+    except Exception:
+        defaults = _default_prompts()
+        save_prompts(defaults)
+        return defaults
+
+
+def save_prompts(data: List[Dict[str, str]]) -> None:
+    """Persist prompts to prompts.json."""
+    global _prompts_cache
+    with _cache_lock:
+        _prompts_cache = copy.deepcopy(data)
+    _write_prompts(data)
+
+
+def _write_prompts(data: List[Dict[str, str]]) -> None:
+    _replace_json(PROMPTS_PATH, data, indent=2, ensure_ascii=False)
+
+
+def cached_config() -> Dict[str, Any]:
+    """Config as last loaded or saved; only reads the file if nothing is cached yet."""
+    return copy.deepcopy(_config_cache) if _config_cache is not None else load_config()
+
+
+def cached_prompts() -> List[Dict[str, str]]:
+    """Prompts as last loaded or saved; only reads the file if nothing is cached yet."""
+    return copy.deepcopy(_prompts_cache) if _prompts_cache is not None else load_prompts()
+
+
+class BackgroundWriter:
+    """Run file writes in order on a single daemon thread, off the Tk thread."""
+
+    def __init__(self):
+        self._queue: "queue.Queue[Any]" = queue.Queue()
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+
+    def submit(self, fn: Any, *args: Any) -> None:
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="file-writer", daemon=True)
+                self._thread.start()
+        self._queue.put((fn, args))
+
+    def flush(self) -> None:
+        """Block until every submitted write has finished."""
+        if self._thread is not None:
+            self._queue.join()
+
+    def _run(self) -> None:
+        while True:
+            fn, args = self._queue.get()
+            try:
+                fn(*args)
+            except Exception:
+                logger.exception("Background write failed: %s", getattr(fn, "__name__", fn))
+            finally:
+                self._queue.task_done()
+
+
+writer = BackgroundWriter()
+
+
+def _write_pending(kind: str, write: Any, data: Any) -> None:
+    try:
+        write(data)
+    finally:
+        with _cache_lock:
+            _pending_writes[kind] -= 1
+
+
+def save_config_async(data: Dict[str, Any]) -> None:
+    """Update the config cache now and write config.json in the background."""
+    global _config_cache
+    snapshot = copy.deepcopy(data)
+    with _cache_lock:
+        _config_cache = copy.deepcopy(snapshot)
+        _pending_writes["config"] += 1
+    writer.submit(_write_pending, "config", _write_config, snapshot)
+
+
+def save_prompts_async(data: List[Dict[str, str]]) -> None:
+    """Update the prompts cache now and write prompts.json in the background."""
+    global _prompts_cache
+    snapshot = copy.deepcopy(data)
+    with _cache_lock:
+        _prompts_cache = copy.deepcopy(snapshot)
+        _pending_writes["prompts"] += 1
+    writer.submit(_write_pending, "prompts", _write_prompts, snapshot)
+
+
+# --------------
+# API Integration
+# --------------
+
+DEFAULT_PROVIDER = "openrouter"
+
+
+def _default_providers() -> Dict[str, Dict[str, Any]]:
+    return {
+        DEFAULT_PROVIDER: {
+            "base_url": "https://openrouter.ai/api/v1",
+            "model": "google/gemini-2.5-flash-preview-09-2025",
+            "headers": {},
+            "timeout": 60,
+            "pool_size": 4,
+            # Falls back to the top-level "api_key" set in Settings
+            "require_api_key": True,
+            # OpenRouter passes cache_control through to models with explicit prompt caching
+            "cache_control": True,
+        },
+    }
+
+
+def provider_names(cfg: Optional[Dict[str, Any]] = None) -> List[str]:
+    """Names of all configured providers (built-in defaults plus config.json)."""
+    cfg = cfg if cfg is not None else load_config()
+    return sorted({**_default_providers(), **(cfg.get("providers") or {})}.keys())
+
+
+def get_provider(cfg: Dict[str, Any], name: Optional[str] = None) -> Dict[str, Any]:
+    """Resolve a provider entry by name, falling back to "default_provider".
+
+    Entries in config.json "providers" override the built-in defaults key by
+    key, so e.g. only "model" may be given to change the OpenRouter model.
+    """
+    name = name or cfg.get("default_provider") or DEFAULT_PROVIDER
+    defaults = _default_providers()
+    configured = (cfg.get("providers") or {}).get(name)
+    if name not in defaults and not isinstance(configured, dict):
+        raise RuntimeError(f"Unknown provider '{name}'. Check \"providers\" in config.json.")
+    provider: Dict[str, Any] = {
+        "headers": {},
+        "timeout": 60,
+        "pool_size": 4,
+        "require_api_key": False,
+        # Static instructions go in a leading system message so they form a cacheable prefix
+        "system_message": True,
+        "cache_control": False,
+    }
+    provider.update(defaults.get(name, {}))
+    provider.update(configured or {})
+    provider["name"] = name
+    if not provider.get("base_url") or not provider.get("model"):
+        raise RuntimeError(f"Provider '{name}' needs both \"base_url\" and \"model\".")
+    return provider
+
+
+_sessions: Dict[Tuple[str, str, int], requests.Session] = {}
+_sessions_lock = threading.Lock()
+
+
+def _provider_session(provider: Dict[str, Any]) -> requests.Session:
+    """Return a pooled, keep-alive session for the provider, created on first use."""
+    import requests
+    from requests.adapters import HTTPAdapter
+
+    pool_size = max(1, int(provider.get("pool_size", 4)))
+    key = (provider["name"], provider["base_url"], pool_size)
+    with _sessions_lock:
+        session = _sessions.get(key)
+        if session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+            _sessions[key] = session
+        return session
+
+
+def _provider_timeout(provider: Dict[str, Any]) -> Any:
+    """Accept either a single number or a [connect, read] pair."""
+    timeout = provider.get("timeout", 60)
+    if isinstance(timeout, (list, tuple)) and len(timeout) == 2:
+        return float(timeout[0]), float(timeout[1])
+    return float(timeout)
+
+
+def _provider_headers(cfg: Dict[str, Any], provider: Dict[str, Any]) -> Dict[str, str]:
+    headers = {"Content-Type": "application/json"}
+    api_key = (provider.get("api_key") or "").strip()
+    if not api_key and provider.get("require_api_key"):
+        api_key = cfg.get("api_key", "").strip()
+        if not api_key or api_key == "YOUR_OPENROUTER_API_KEY_HERE":
+            raise RuntimeError("OpenRouter API key missing. Set it in Settings (⚙️).")
+    if api_key:
+        headers["Authorization"] = f"Bearer {api_key}"
+    headers.update({str(k): str(v) for k, v in (provider.get("headers") or {}).items()})
+    return headers
+
+
+class CallLog:
+    """Provider calls made for one rewrite, for trace records.
+
+    Passed down explicitly because chunked, incremental and batched rewrites
+    make their calls from worker threads.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.calls: List[Dict[str, Any]] = []
+
+    def add(self, **call: Any) -> None:
+        with self._lock:
+            self.calls.append(call)
+
+    def summary(self) -> Dict[str, Any]:
+        """Totals over all calls; provider and model are the last call's (None on a cache hit)."""
+        with self._lock:
+            calls = list(self.calls)
+        last = calls[-1] if calls else {}
+        return {
+            "calls": len(calls),
+            "provider": last.get("provider"),
+            "model": last.get("model"),
+            "http_ms": round(sum(c["http_ms"] for c in calls), 1) if calls else None,
+            "prompt_tokens": sum(c["prompt_tokens"] for c in calls) if calls else None,
+            "cached_tokens": sum(c["cached_tokens"] for c in calls) if calls else None,
+        }
+
+
+# Selections at or above this many characters take the streaming request path.
+STREAM_THRESHOLD_CHARS = 256 * 1024
+# Default hard cap on selection size; override with "max_input_chars" in config.json.
+DEFAULT_MAX_INPUT_CHARS = 4 * 1024 * 1024
+_STREAM_CHUNK_CHARS = 64 * 1024
+
+STRICT_SUFFIX = "\n\nIMPORTANT: Output ONLY the rewritten text. Do not add any explanations, preambles, notes, or surrounding text. Just the result."
+
+# Edit-script mode: the model replies with find/replace edits instead of the full text
+EDITS_SUFFIX = (
+    "\n\nIMPORTANT: Do NOT output the rewritten text. Output ONLY a JSON array of edits, for example "
+    '[{"old": "teh cat", "new": "the cat"}]. Copy each "old" exactly from the text, with just enough '
+    "surrounding words to make it unique, and list edits in the order they appear. "
+    "Output [] if nothing needs to change. No explanations, no code fences. "
+    "This replaces any earlier instruction about what to output."
+)
+
+# The "Output ONLY the corrected text ..." sentence of the built-in prompts contradicts EDITS_SUFFIX,
+# so edit mode drops that exact form; any other instruction is left to EDITS_SUFFIX to override
+_OUTPUT_ONLY_SENTENCE = re.compile(r"[ \t]*\bOutput ONLY the (?:\w+ )?text\b[^.!?:\n{]*[.!?:]?", re.IGNORECASE)
+_OUTPUT_SUFFIXES = {"text": STRICT_SUFFIX, "edits": EDITS_SUFFIX}
+
+_TEXT_SLOT = "\x00__quick_rewriter_text__\x00"
+
+# A span is (source, start, end); slicing is deferred so large text is never copied whole.
+Span = Tuple[str, int, int]
+
+
+class InputTooLarge(RuntimeError):
+    """The selection is over the size cap, or too large for every model preflight may use."""
+
+
+def input_size_error(n_chars: int, cfg: Optional[Dict[str, Any]] = None) -> Optional[str]:
+    """Return an error message if a selection of n_chars exceeds the configured cap."""
+    cfg = cfg if cfg is not None else load_config()
+    try:
+        limit = int(cfg.get("max_input_chars", DEFAULT_MAX_INPUT_CHARS))
+    except (TypeError, ValueError):
+        limit = DEFAULT_MAX_INPUT_CHARS
+    if limit > 0 and n_chars > limit:
+        return f"Selection too large ({n_chars:,} chars, limit {limit:,})."
+    return None
+
+
+def _whole(s: str) -> Span:
+    return (s, 0, len(s))
+
+
+def _prompt_spans(captured_text: str, instruction_or_template: str, suffix: str = STRICT_SUFFIX) -> List[Span]:
+    """Describe the final prompt as spans over the template pieces and captured_text."""
+    template = instruction_or_template or ""
+
+    if "{text}" in template:
+        try:
+            pieces = template.format(text=_TEXT_SLOT).split(_TEXT_SLOT)
+        except Exception:
+            # Fallback to concatenation if formatting fails
+            return [_whole(f"{template}\n\n"), _whole(captured_text), _whole(suffix)]
+        spans = [_whole(pieces[0])]
+        for piece in pieces[1:]:
+            spans.append(_whole(captured_text))
+            spans.append(_whole(piece))
+        spans.append(_whole(suffix))
+        return spans
+
+    # Equivalent to f"{template.strip()}\n\n{captured_text}".strip() without the copy
+    head = template.strip()
+    start, end = 0, len(captured_text)
+    while end > start and captured_text[end - 1].isspace():
+        end -= 1
+    if not head:
+        while start < end and captured_text[start].isspace():
+            start += 1
+    if start >= end:
+        return [_whole(head), _whole(suffix)]
+    prefix = f"{head}\n\n" if head else ""
+    return [_whole(prefix), (captured_text, start, end), _whole(suffix)]
+
+
+def _combine_prompt(captured_text: str, instruction_or_template: str) -> str:
+    return "".join(s[a:b] for s, a, b in _prompt_spans(captured_text, instruction_or_template))
+
+
+_TEXT_REFERENCE = "[TEXT]"
+
+
+def _system_instructions(instruction_or_template: str, suffix: str = STRICT_SUFFIX) -> str:
+    """Static part of the prompt, with no user text, for the leading system message.
+
+    A template that ends in {text} loses the placeholder; one with text after
+    it refers to the user message by [TEXT] instead. Templates that can't be
+    formatted (e.g. literal braces in a JSON example) are split on {text} as is.
+    """
+    template = instruction_or_template or ""
+    instructions = template.strip()
+    if "{text}" in template:
+        try:
+            pieces = template.format(text=_TEXT_SLOT).split(_TEXT_SLOT)
+        except Exception:
+            pieces = template.split("{text}")
+        if len(pieces) == 2 and not pieces[1].strip():
+            instructions = pieces[0].strip()
+        else:
+            instructions = (
+                _TEXT_REFERENCE.join(pieces).strip()
+                + f"\n\n{_TEXT_REFERENCE} is the text given in the user message."
+            )
+    return (instructions + suffix).strip()
+
+
+def _build_messages(
+    provider: Dict[str, Any],
+    captured_text: str,
+    instruction_or_template: str,
+    suffix: str = STRICT_SUFFIX,
+) -> Tuple[List[Dict[str, Any]], List[Span]]:
+    """Chat messages with _TEXT_SLOT where the user text goes, plus the spans that fill it.
+
+    Providers reuse cached prompt prefixes, so the static instructions come
+    first (optionally marked with cache_control) and the variable text last.
+    """
+    if not provider.get("system_message", True):
+        return [{"role": "user", "content": _TEXT_SLOT}], _prompt_spans(captured_text, instruction_or_template, suffix)
+
+    system_text = _system_instructions(instruction_or_template, suffix)
+    system_content: Any = system_text
+    if provider.get("cache_control"):
+        system_content = [{"type": "text", "text": system_text, "cache_control": {"type": "ephemeral"}}]
+    messages = [
+        {"role": "system", "content": system_content},
+        {"role": "user", "content": _TEXT_SLOT},
+    ]
+    return messages, [_whole(captured_text)]
+
+
+class UsageStats:
+    """Running token totals per provider/model, including prompt tokens served from cache."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._totals: Dict[str, Dict[str, int]] = {}
+
+    def record(self, provider_name: str, model: str, usage: Any) -> Tuple[int, int]:
+        """Add a response "usage" block; returns (prompt_tokens, cached_tokens)."""
+        if not isinstance(usage, dict):
+            return 0, 0
+        prompt_tokens = int(usage.get("prompt_tokens") or 0)
+        details = usage.get("prompt_tokens_details") or {}
+        cached_tokens = int(details.get("cached_tokens") or usage.get("cache_read_input_tokens") or 0)
+        completion_tokens = int(usage.get("completion_tokens") or 0)
+        with self._lock:
+            totals = self._totals.setdefault(
+                f"{provider_name}|{model}",
+                {"calls": 0, "prompt_tokens": 0, "cached_tokens": 0, "completion_tokens": 0},
+            )
+            totals["calls"] += 1
+            totals["prompt_tokens"] += prompt_tokens
+            totals["cached_tokens"] += cached_tokens
+            totals["completion_tokens"] += completion_tokens
+        return prompt_tokens, cached_tokens
+
+    def snapshot(self) -> Dict[str, Dict[str, int]]:
+        with self._lock:
+            return {key: dict(totals) for key, totals in self._totals.items()}
+
+
+usage_stats = UsageStats()
+
+
+def _iter_json_body(payload: Dict[str, Any], spans: List[Span]) -> Iterator[bytes]:
+    """Encode payload as JSON, streaming spans in place of the _TEXT_SLOT string.
+
+    Only one chunk of the text is ever encoded at a time, so the request body
+    is never materialized in full.
+    """
+    slot = json.dumps(_TEXT_SLOT)[1:-1]
+    before, after = json.dumps(payload).split(slot, 1)
+    yield before.encode("ascii")
+    for s, a, b in spans:
+        for pos in range(a, b, _STREAM_CHUNK_CHARS):
+            chunk = s[pos:min(pos + _STREAM_CHUNK_CHARS, b)]
+            yield json.dumps(chunk)[1:-1].encode("ascii")
+    yield after.encode("ascii")
+
+
+def call_openrouter_api(
+    captured_text: str,
+    instruction_or_template: str,
+    provider_name: Optional[str] = None,
+    model: Optional[str] = None,
+    cfg: Optional[Dict[str, Any]] = None,
+    output: str = "text",
+    calls: Optional[CallLog] = None,
+) -> str:
+    """Send the final prompt to an OpenAI-compatible provider and return first choice content.
+
+    OpenRouter is the default provider; provider_name selects another entry
+    from "providers" in config.json (e.g. a local llama.cpp or vLLM server).
+    model overrides the provider's configured model; cfg replaces config.json.
+    output="edits" asks for a JSON edit list instead of the full text.
+    Successful calls are added to calls, if given.
+    """
+    cfg = cfg if cfg is not None else load_config()
+    provider = get_provider(cfg, provider_name)
+    headers = _provider_headers(cfg, provider)
+
+    too_large = input_size_error(len(captured_text), cfg)
+    if too_large:
+        raise InputTooLarge(too_large)
+
+    url = provider["base_url"].rstrip("/") + "/chat/completions"
+    session = _provider_session(provider)
+    timeout = _provider_timeout(provider)
+    if output == "edits":
+        instruction_or_template = _OUTPUT_ONLY_SENTENCE.sub("", instruction_or_template or "")
+    messages, spans = _build_messages(provider, captured_text, instruction_or_template, _OUTPUT_SUFFIXES[output])
+    json_data = {
+        "model": model or provider["model"],
+        "messages": messages,
+    }
+
+    started = time.perf_counter()
+
+    if len(captured_text) >= STREAM_THRESHOLD_CHARS:
+        # Large payload: stream the body in chunks instead of building it in memory
+        response = session.post(
+            url, headers=headers, data=_iter_json_body(json_data, spans), timeout=timeout, stream=True
+        )
+    else:
+        messages[-1]["content"] = "".join(s[a:b] for s, a, b in spans)
+        response = session.post(url, headers=headers, json=json_data, timeout=timeout, stream=True)
+    try:
+        response.raise_for_status()
+        # Read the body once and drop each stage as soon as the next exists, so at most
+        # two copies of the reply are alive (response.content would keep the bytes cached)
+        body = response.raw.read(decode_content=True).decode("utf-8")
+        data = json.loads(body)
+        del body
+    finally:
+        response.close()
+    http_ms = (time.perf_counter() - started) * 1000
+    prompt_tokens, cached_tokens = usage_stats.record(provider["name"], json_data["model"], data.get("usage"))
+    if calls is not None:
+        calls.add(
+            provider=provider["name"],
+            model=json_data["model"],
+            http_ms=http_ms,
+            prompt_tokens=prompt_tokens,
+            cached_tokens=cached_tokens,
+        )
+    choices = data.get("choices", [])
+    if not choices:
+        raise RuntimeError(f"No choices returned from {provider['name']}.")
+    content = choices[0].get("message", {}).get("content", "")
+    if not content:
+        raise RuntimeError(f"Empty response content from {provider['name']}.")
+    return content
+
+
+# -------------
+# Model Routing
+# -------------
+
+# Upper bounds (in characters) of the input-size buckets used for routing stats
+SIZE_BUCKETS = (1_000, 4_000, 16_000, 64_000)
+
+
+def size_bucket(n_chars: int) -> str:
+    for bound in SIZE_BUCKETS:
+        if n_chars < bound:
+            return f"<{bound // 1000}k"
+    return f">={SIZE_BUCKETS[-1] // 1000}k"
+
+
+class ModelRouter:
+    """Pick the fastest healthy model per input-size bucket from exponentially weighted stats.
+
+    Stats are keyed by "provider|model" and size bucket and persisted to
+    router_stats.json so routing decisions survive restarts.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._stats: Dict[str, Dict[str, Dict[str, float]]] = {}
+        self._loaded = False
+
+    def _ensure_loaded(self) -> None:
+        if self._loaded:
+            return
+        self._loaded = True
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            if isinstance(data, dict):
+                self._stats = data
+        except Exception:
+            self._stats = {}
+
+    def _save(self) -> None:
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self._stats, f, indent=2)
+        os.replace(tmp_path, self.path)
+
+    def rank(self, candidates: List[Tuple[str, str]], n_chars: int, routing: Dict[str, Any]) -> List[Tuple[str, str]]:
+        """Order (provider, model) candidates best-first for an input of n_chars."""
+        bucket = size_bucket(n_chars)
+        max_error_rate = float(routing.get("max_error_rate", 0.5))
+        retry_after = float(routing.get("retry_unhealthy_after", 300))
+        explore = float(routing.get("explore_rate", 0.05))
+        now = time.time()
+        with self._lock:
+            self._ensure_loaded()
+            scored = []
+            for order, cand in enumerate(candidates):
+                st = self._stats.get(f"{cand[0]}|{cand[1]}", {}).get(bucket)
+                if not st:
+                    # Unmeasured models are tried first so every candidate gets a sample
+                    scored.append(((0, 0.0, order), cand))
+                elif st["error_rate"] > max_error_rate:
+                    # Unhealthy: give it another chance once the cool-down has passed
+                    if now - st["updated"] >= retry_after:
+                        scored.append(((0, 0.0, order), cand))
+                    else:
+                        scored.append(((2, st["error_rate"], order), cand))
+                else:
+                    scored.append(((1, st["latency"], order), cand))
+        ranked = [cand for _, cand in sorted(scored)]
+        # Occasionally probe a runner-up so stale stats get refreshed
+        if len(ranked) > 1 and random.random() < explore:
+            ranked.insert(0, ranked.pop(random.randrange(1, len(ranked))))
+        return ranked
+
+    def record(self, provider_name: str, model: str, n_chars: int, latency: float, ok: bool, alpha: float = 0.3) -> None:
+        bucket = size_bucket(n_chars)
+        with self._lock:
+            self._ensure_loaded()
+            st = self._stats.setdefault(f"{provider_name}|{model}", {}).get(bucket)
+            if st is None:
+                st = {"latency": latency, "error_rate": 0.0 if ok else 1.0, "count": 0}
+                self._stats[f"{provider_name}|{model}"][bucket] = st
+            else:
+                # Failed calls only move the error rate; their latency is not representative
+                if ok:
+                    st["latency"] = alpha * latency + (1 - alpha) * st["latency"]
+                st["error_rate"] = alpha * (0.0 if ok else 1.0) + (1 - alpha) * st["error_rate"]
+            st["count"] += 1
+            st["updated"] = time.time()
+            try:
+                self._save()
+            except Exception:
+                pass  # Stats are best-effort; never fail a rewrite over them
+
+    def load(self) -> None:
+        """Read persisted stats now rather than on first use."""
+        with self._lock:
+            self._ensure_loaded()
+
+    def summary(self) -> List[Tuple[str, str, Dict[str, float]]]:
+        """Snapshot of (model key, bucket, stats) rows for display."""
+        with self._lock:
+            self._ensure_loaded()
+            return [
+                (key, bucket, dict(st))
+                for key, buckets in sorted(self._stats.items())
+                for bucket, st in buckets.items()
+            ]
+
+
+router = ModelRouter(ROUTER_STATS_PATH)
+
+
+def _routing_candidates(cfg: Dict[str, Any]) -> List[Tuple[str, str]]:
+    """Resolve the "routing" allow-list into (provider, model) pairs."""
+    candidates = []
+    for item in (cfg.get("routing") or {}).get("models") or []:
+        if isinstance(item, str):
+            item = {"model": item}
+        if not isinstance(item, dict):
+            continue
+        provider = get_provider(cfg, item.get("provider"))
+        candidates.append((provider["name"], item.get("model") or provider["model"]))
+    return candidates
+
+
+def rewrite_with_routing(
+    captured_text: str,
+    instruction_or_template: str,
+    provider_name: Optional[str] = None,
+    cfg: Optional[Dict[str, Any]] = None,
+    output: str = "text",
+    calls: Optional[CallLog] = None,
+) -> str:
+    """Call the best model for this request, falling back to the next one on failure.
+
+    Routing applies only when "routing" is enabled in config.json and the
+    prompt does not pin a provider; otherwise this is call_openrouter_api.
+    """
+    cfg = cfg if cfg is not None else load_config()
+    routing = cfg.get("routing") or {}
+    candidates = _routing_candidates(cfg) if routing.get("enabled") and not provider_name else []
+    if not candidates:
+        return call_openrouter_api(captured_text, instruction_or_template, provider_name, cfg=cfg, output=output, calls=calls)
+
+    n_chars = len(captured_text)
+    # Reject oversized input before it can count against any model's error rate
+    too_large = input_size_error(n_chars, cfg)
+    if too_large:
+        raise InputTooLarge(too_large)
+    alpha = float(routing.get("alpha", 0.3))
+    attempts = router.rank(candidates, n_chars, routing)[: max(1, int(routing.get("max_attempts", 2)))]
+    last_error: Optional[Exception] = None
+    for cand_provider, cand_model in attempts:
+        started = time.perf_counter()
+        try:
+            result = call_openrouter_api(captured_text, instruction_or_template, cand_provider, cand_model, cfg, output, calls)
+        except Exception as e:
+            router.record(cand_provider, cand_model, n_chars, time.perf_counter() - started, False, alpha)
+            last_error = e
+            continue
+        router.record(cand_provider, cand_model, n_chars, time.perf_counter() - started, True, alpha)
+        return result
+    raise last_error
+
+
+# -----------
+# Diagnostics
+# -----------
+
+DEFAULT_PROFILE_RUNS = 5
+
+
+class StackSampler:
+    """Periodically sample the stacks of all threads (Tk, hotkey listener, workers)."""
+
+    def __init__(self, interval: float = 0.01):
+        self.interval = interval
+        self.samples: Counter = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="stack-sampler", daemon=True)
+
+    def start(self) -> None:
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self) -> None:
+        own_id = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            names = {t.ident: t.name for t in threading.enumerate()}
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+                stack = []
+                while frame is not None:
+                    stack.append(f"{frame.f_code.co_name} ({os.path.basename(frame.f_code.co_filename)}:{frame.f_lineno})")
+                    frame = frame.f_back
+                stack.append(names.get(thread_id, str(thread_id)))
+                self.samples[";".join(reversed(stack))] += 1
+
+    def collapsed(self) -> str:
+        """Samples in collapsed-stack format (one "frames count" line per stack), as used by flame graph tools."""
+        return "".join(f"{stack} {count}\n" for stack, count in self.samples.most_common())
+
+
+class RewriteProfiler:
+    """Profile the next N rewrites with cProfile, tracemalloc and thread-stack sampling.
+
+    While disarmed, run() costs one attribute check before calling through.
+    Only one rewrite is profiled at a time; rewrites that overlap it run
+    unprofiled and don't use up a run. Reports for each armed session go to
+    a timestamped folder under profiles/.
+    """
+
+    def __init__(self, root_dir: str):
+        self.root_dir = root_dir
+        self.remaining = 0
+        self.session_dir: Optional[str] = None
+        self._count = 0
+        self._active = False
+        self._lock = threading.Lock()
+
+    def arm(self, runs: int = DEFAULT_PROFILE_RUNS) -> str:
+        """Profile the next `runs` rewrites; returns the report directory."""
+        with self._lock:
+            self.session_dir = os.path.join(self.root_dir, datetime.now().strftime("%Y%m%d-%H%M%S"))
+            self._count = 0
+            self.remaining = max(0, int(runs))
+            logger.info("Profiling armed for %d rewrite(s); reports in %s", self.remaining, self.session_dir)
+            return self.session_dir
+
+    def disarm(self) -> None:
+        with self._lock:
+            self.remaining = 0
+
+    def run(self, fn: Any, *args: Any) -> Any:
+        if not self.remaining:
+            return fn(*args)
+        with self._lock:
+            # tracemalloc and the sampler are process-wide, so overlapping rewrites run unprofiled
+            if not self.remaining or self._active:
+                slot = None
+            else:
+                self.remaining -= 1
+                self._count += 1
+                self._active = True
+                slot = (self.session_dir, self._count)
+        if slot is None:
+            return fn(*args)
+        try:
+            return self._profiled(slot[0], slot[1], fn, args)
+        finally:
+            with self._lock:
+                self._active = False
+
+    def _profiled(self, session_dir: str, index: int, fn: Any, args: Tuple[Any, ...]) -> Any:
+        import cProfile
+
+        started_tracing = False
+        try:
+            started_tracing = not tracemalloc.is_tracing()
+            if started_tracing:
+                tracemalloc.start(25)
+            tracemalloc.reset_peak()
+            profile = cProfile.Profile()
+            # Raises if another profiler is active (Python 3.12+), so enable before starting the sampler thread
+            profile.enable()
+        except Exception:
+            logger.exception("Could not start profiling; running this rewrite unprofiled")
+            if started_tracing:
+                tracemalloc.stop()
+            return fn(*args)
+
+        sampler = StackSampler()
+        sampler.start()
+        started = time.perf_counter()
+        try:
+            return fn(*args)
+        finally:
+            profile.disable()
+            elapsed = time.perf_counter() - started
+            sampler.stop()
+            try:
+                snapshot = tracemalloc.take_snapshot()
+                current, peak = tracemalloc.get_traced_memory()
+                self._write_reports(session_dir, index, elapsed, profile, snapshot, current, peak, sampler)
+            except Exception:
+                logger.exception("Failed to write profile reports to %s", session_dir)
+            finally:
+                if started_tracing:
+                    tracemalloc.stop()
+
+    def _write_reports(
+        self,
+        session_dir: str,
+        index: int,
+        elapsed: float,
+        profile: cProfile.Profile,
+        snapshot: tracemalloc.Snapshot,
+        current: int,
+        peak: int,
+        sampler: StackSampler,
+    ) -> None:
+        import pstats
+
+        os.makedirs(session_dir, exist_ok=True)
+        base = os.path.join(session_dir, f"rewrite-{index}")
+
+        profile.dump_stats(base + ".prof")
+        text = io.StringIO()
+        text.write(f"Wall time: {elapsed * 1000:.1f} ms\n\n")
+        pstats.Stats(profile, stream=text).sort_stats("cumulative").print_stats(40)
+        with open(base + "-cprofile.txt", "w", encoding="utf-8") as f:
+            f.write(text.getvalue())
+
+        with open(base + "-tracemalloc.txt", "w", encoding="utf-8") as f:
+            f.write(f"Current: {current / 1024:.1f} KiB  Peak: {peak / 1024:.1f} KiB\n\n")
+            for stat in snapshot.statistics("lineno")[:30]:
+                f.write(f"{stat}\n")
+
+        with open(base + "-stacks.txt", "w", encoding="utf-8") as f:
+            f.write(sampler.collapsed())
+        logger.info("Profile of rewrite %d written to %s (%.0f ms)", index, session_dir, elapsed * 1000)
+
+
+profiler = RewriteProfiler(PROFILES_DIR)
+
+
+class TraceRecorder:
+    """Append anonymized per-rewrite traces (sizes, prompt name, timings) to traces/*.jsonl.
+
+    No text is ever written: only character counts, the quick prompt name
+    (or "(custom)" for typed instructions), inter-arrival gaps and stage
+    timings. replay_traces.py reads these files.
+    """
+
+    def __init__(self, root_dir: str):
+        self.root_dir = root_dir
+        self._last_hotkey: Optional[float] = None
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def enabled(cfg: Dict[str, Any]) -> bool:
+        return bool((cfg.get("tracing") or {}).get("enabled"))
+
+    def start(self, capture_ms: float, input_chars: int) -> Dict[str, Any]:
+        """Begin a trace at hotkey time; the dict is filled in as the rewrite proceeds."""
+        now = time.time()
+        with self._lock:
+            gap = None if self._last_hotkey is None else now - self._last_hotkey
+            self._last_hotkey = now
+        return {
+            "ts": round(now, 3),
+            "gap_s": None if gap is None else round(gap, 3),
+            "input_chars": input_chars,
+            "capture_ms": round(capture_ms, 1),
+        }
+
+    def record(self, trace: Dict[str, Any]) -> None:
+        path = os.path.join(self.root_dir, f"trace-{datetime.now():%Y%m%d}.jsonl")
+        line = json.dumps(trace, ensure_ascii=False) + "\n"
+        with self._lock:
+            try:
+                os.makedirs(self.root_dir, exist_ok=True)
+                with open(path, "a", encoding="utf-8") as f:
+                    f.write(line)
+            except Exception:
+                logger.exception("Failed to write trace to %s", path)
+
+
+recorder = TraceRecorder(TRACES_DIR)
+
+
+# -----------------
+# Batched Requests
+# -----------------
+
+_ITEM_MARKER = "<<<ITEM {}>>>"
+_ITEM_SPLIT = re.compile(r"^[ \t]*<<<ITEM (\d+)>>>[ \t]*$", re.MULTILINE)
+
+_BATCH_HEADER = (
+    "The text below contains {count} separate items. Each item starts with a marker line "
+    "of the form <<<ITEM n>>>. Apply the following instructions to every item independently. "
+    "Reply with each result preceded by its original marker line, in the same order, and "
+    "nothing else."
+)
+
+
+def can_batch(text: str) -> bool:
+    """Texts containing the item marker would confuse the reply split."""
+    return "<<<ITEM" not in text
+
+
+def pack_batch(texts: List[str], instruction: str) -> Tuple[str, str]:
+    """Build the (combined text, instruction) for one request covering several texts."""
+    combined = "\n".join(f"{_ITEM_MARKER.format(i)}\n{text}" for i, text in enumerate(texts, 1))
+    return combined, f"{_BATCH_HEADER.format(count=len(texts))}\n\n{instruction}"
+
+
+def split_batch_reply(reply: str, count: int) -> Optional[List[str]]:
+    """Split a marker-delimited reply into exactly `count` results, or None if malformed."""
+    parts = _ITEM_SPLIT.split(reply)
+    # parts = [preamble, "1", body1, "2", body2, ...]
+    numbers = parts[1::2]
+    bodies = parts[2::2]
+    if numbers != [str(i) for i in range(1, count + 1)]:
+        return None
+    results = [body.strip() for body in bodies]
+    if any(not r for r in results):
+        return None
+    return results
+
+
+# -----------------------
+# Incremental Re-rewrites
+# -----------------------
+
+# Paragraphs are separated by one or more blank lines (LF or CRLF); the separators are kept verbatim
+_PARAGRAPH_BREAK = re.compile(r"(\r?\n[ \t]*\r?\n\s*)")
+_BLANK_LINES = re.compile(r"\r?\n[ \t]*\r?\n\s*")
+
+
+def split_paragraphs(text: str) -> List[str]:
+    """Split into alternating [paragraph, separator, paragraph, ...]; "".join() restores text."""
+    return _PARAGRAPH_BREAK.split(text)
+
+
+def _model_identity(cfg: Dict[str, Any], provider_name: Optional[str]) -> str:
+    """What produced a result, for cache keys: the provider model, or the routing allow-list."""
+    routing = cfg.get("routing") or {}
+    if routing.get("enabled") and not provider_name:
+        return "routed:" + ",".join(sorted(f"{p}|{m}" for p, m in _routing_candidates(cfg)))
+    provider = get_provider(cfg, provider_name)
+    return f"{provider['name']}|{provider['model']}"
+
+
+def _keep_outer_whitespace(original: str, rewritten: str) -> str:
+    """Give the rewritten text the original's leading and trailing whitespace."""
+    core = original.strip()
+    start = original.index(core[0]) if core else 0
+    return original[:start] + rewritten.strip() + original[start + len(core):]
+
+
+def _reshape_paragraph(original: str, rewritten: str) -> str:
+    """Keep the original paragraph's surrounding whitespace and keep it a single paragraph."""
+    return _keep_outer_whitespace(original, _BLANK_LINES.sub("\n", rewritten.strip()))
+
+
+# -----------------
+# Edit-script Output
+# -----------------
+
+_CODE_FENCE = re.compile(r"^```[a-zA-Z]*\s*\n?|\n?```\s*$")
+
+
+def parse_edits(reply: str) -> Optional[List[Tuple[str, str]]]:
+    """Parse a JSON edit list reply into (old, new) pairs, or None if it is malformed."""
+    body = _CODE_FENCE.sub("", reply.strip())
+    try:
+        data = json.loads(body)
+    except ValueError:
+        return None
+    if not isinstance(data, list):
+        return None
+    edits = []
+    for item in data:
+        if not isinstance(item, dict):
+            return None
+        old, new = item.get("old"), item.get("new")
+        if not isinstance(old, str) or not old or not isinstance(new, str):
+            return None
+        edits.append((old, new))
+    return edits
+
+
+def apply_edits(text: str, edits: List[Tuple[str, str]]) -> Optional[str]:
+    """Apply find/replace edits to text, or return None if any edit can't be placed unambiguously.
+
+    Each "old" is looked up after the previous edit and must not occur there
+    more often than the edits still listed for it; one listed out of order is
+    accepted only if it occurs exactly once. Overlapping edits are rejected.
+    """
+    located: List[Tuple[int, int, str]] = []
+    pos = 0
+    for i, (old, new) in enumerate(edits):
+        start = text.find(old, pos)
+        if start >= 0 and text.count(old, pos) > sum(1 for o, _ in edits[i:] if o == old):
+            return None
+        if start < 0:
+            start = text.find(old)
+            if start < 0 or text.find(old, start + 1) >= 0:
+                return None
+        located.append((start, start + len(old), new))
+        pos = start + len(old)
+
+    located.sort()
+    out: List[str] = []
+    pos = 0
+    for start, end, new in located:
+        if start < pos:
+            return None
+        out.append(text[pos:start])
+        out.append(new)
+        pos = end
+    out.append(text[pos:])
+    return "".join(out)
+
+
+# ----------------
+# Token Preflight
+# ----------------
+
+# Context window and output cap per model; extend or override with "model_limits" in config.json
+_DEFAULT_MODEL_LIMITS: Dict[str, Dict[str, int]] = {
+    "google/gemini-2.5-flash-preview-09-2025": {"context": 1_048_576, "max_output": 65_536},
+}
+DEFAULT_CONTEXT_TOKENS = 32_768
+# Headroom for chat formatting and estimator error
+_TOKEN_MARGIN = 256
+
+_token_cache: "OrderedDict[Tuple[int, int], int]" = OrderedDict()
+_token_cache_lock = threading.Lock()
+_TOKEN_CACHE_ENTRIES = 256
+
+
+def estimate_tokens(text: str) -> int:
+    """Fast local token estimate: ~4 ASCII characters per token, 1 token per other character.
+
+    Deliberately errs high for accented and CJK text. Results are cached per
+    text (by length and str hash, which Python caches on the object), so
+    checking the same selection again is free.
+    """
+    key = (len(text), hash(text))
+    with _token_cache_lock:
+        cached = _token_cache.get(key)
+        if cached is not None:
+            _token_cache.move_to_end(key)
+            return cached
+    non_ascii = 0
+    for pos in range(0, len(text), _STREAM_CHUNK_CHARS):
+        chunk = text[pos:pos + _STREAM_CHUNK_CHARS]
+        if not chunk.isascii():
+            non_ascii += len(chunk) - len(chunk.encode("ascii", "ignore"))
+    tokens = math.ceil((len(text) - non_ascii) / 4) + non_ascii
+    with _token_cache_lock:
+        _token_cache[key] = tokens
+        while len(_token_cache) > _TOKEN_CACHE_ENTRIES:
+            _token_cache.popitem(last=False)
+    return tokens
+
+
+def model_limits(cfg: Dict[str, Any], model: str) -> Dict[str, int]:
+    """{"context": ..., "max_output": ...} for a model; max_output is absent when unknown."""
+    configured = (cfg.get("model_limits") or {}).get(model)
+    limits = dict(_DEFAULT_MODEL_LIMITS.get(model, {}))
+    if isinstance(configured, dict):
+        limits.update({k: int(v) for k, v in configured.items() if k in ("context", "max_output")})
+    elif isinstance(configured, (int, float)):
+        limits["context"] = int(configured)
+    limits.setdefault("context", int(cfg.get("default_context_tokens", DEFAULT_CONTEXT_TOKENS)))
+    return limits
+
+
+def _fits(limits: Dict[str, int], input_tokens: int, output_tokens: int) -> bool:
+    if input_tokens + output_tokens + _TOKEN_MARGIN > limits["context"]:
+        return False
+    return output_tokens <= limits.get("max_output", output_tokens)
+
+
+def _chunk_budget(limits: Dict[str, int], instruction_tokens: int) -> int:
+    """Largest text (in tokens) one request can take when the reply is about as long as the input."""
+    budget = (limits["context"] - instruction_tokens - _TOKEN_MARGIN) // 2
+    if "max_output" in limits:
+        budget = min(budget, limits["max_output"])
+    return max(1, budget)
+
+
+def _target_models(cfg: Dict[str, Any], provider_name: Optional[str]) -> List[Tuple[str, str]]:
+    """Every (provider, model) this request may be sent to."""
+    routing = cfg.get("routing") or {}
+    if routing.get("enabled") and not provider_name:
+        candidates = _routing_candidates(cfg)
+        if candidates:
+            return candidates
+    provider = get_provider(cfg, provider_name)
+    return [(provider["name"], provider["model"])]
+
+
+def preflight(text: str, instruction: str, provider_name: Optional[str], cfg: Dict[str, Any]) -> Dict[str, Any]:
+    """Decide how to send a request before anything goes over the network.
+
+    Returns a plan whose "action" is "send" (fits), "switch" (use the larger
+    "provider"/"model" given), "chunk" (split into pieces of at most
+    "chunk_tokens") or "reject" (with "message"). "preflight" in config.json
+    limits the choices: "action" may be "auto" (default), "switch", "chunk"
+    or "reject", and "fallback_models" lists larger-context models to try.
+    """
+    text_tokens = estimate_tokens(text)
+    instruction_tokens = estimate_tokens(instruction) + estimate_tokens(STRICT_SUFFIX)
+    input_tokens = text_tokens + instruction_tokens
+    plan: Dict[str, Any] = {"tokens": input_tokens, "action": "send"}
+
+    # With routing, the request must fit every candidate it may be sent to
+    targets = _target_models(cfg, provider_name)
+    limits = min((model_limits(cfg, m) for _, m in targets), key=lambda lim: _chunk_budget(lim, instruction_tokens))
+    plan["limit"] = limits["context"]
+    if _fits(limits, input_tokens, text_tokens):
+        return plan
+
+    pf_cfg = cfg.get("preflight") or {}
+    action = pf_cfg.get("action", "auto")
+    if action in ("auto", "switch"):
+        for item in pf_cfg.get("fallback_models") or []:
+            if isinstance(item, str):
+                item = {"model": item}
+            if not isinstance(item, dict):
+                continue
+            fallback = get_provider(cfg, item.get("provider") or provider_name)
+            fallback_model = item.get("model") or fallback["model"]
+            if _fits(model_limits(cfg, fallback_model), input_tokens, text_tokens):
+                plan.update(action="switch", provider=fallback["name"], model=fallback_model)
+                return plan
+    if action in ("auto", "chunk"):
+        plan.update(action="chunk", chunk_tokens=_chunk_budget(limits, instruction_tokens))
+        return plan
+    plan.update(
+        action="reject",
+        message=(
+            f"Selection is too large for the model: ≈{input_tokens:,} tokens plus a reply of similar "
+            f"length exceeds its {limits['context']:,}-token limit."
+        ),
+    )
+    return plan
+
+
+def split_into_chunks(text: str, max_tokens: int) -> List[str]:
+    """Split text at paragraph breaks into pieces of at most ~max_tokens; "".join() restores it."""
+    parts = split_paragraphs(text)
+    pieces = [parts[i] + (parts[i + 1] if i + 1 < len(parts) else "") for i in range(0, len(parts), 2)]
+    chunks: List[str] = []
+    current: List[str] = []
+    current_tokens = 0
+    for piece in pieces:
+        piece_tokens = estimate_tokens(piece)
+        if current and current_tokens + piece_tokens > max_tokens:
+            chunks.append("".join(current))
+            current, current_tokens = [], 0
+        if piece_tokens > max_tokens:
+            # One paragraph alone is too big: cut it at whitespace near the budget
+            pos = 0
+            while pos < len(piece):
+                # Start from the ASCII best case and shrink until the estimate fits (dense text is ~1 char/token)
+                end = min(len(piece), pos + max(1, max_tokens * 4))
+                tokens = estimate_tokens(piece[pos:end])
+                while tokens > max_tokens and end - pos > 1:
+                    end = pos + max(1, min(end - pos - 1, (end - pos) * max_tokens // tokens))
+                    tokens = estimate_tokens(piece[pos:end])
+                if end < len(piece):
+                    cut = piece.rfind(" ", pos + 1, end)
+                    end = cut + 1 if cut > pos else end
+                chunks.append(piece[pos:end])
+                pos = end
+            continue
+        current.append(piece)
+        current_tokens += piece_tokens
+    if current:
+        chunks.append("".join(current))
+    return chunks
+
+
+# ---------
+# Rewriter
+# ---------
+
+DEFAULT_CACHE_ENTRIES = 64
+DEFAULT_PARAGRAPH_CACHE_ENTRIES = 2000
+
+
+def _text_digest(*parts: str) -> str:
+    """SHA-256 over the parts, encoding large strings a chunk at a time."""
+    digest = hashlib.sha256()
+    for part in parts:
+        for pos in range(0, len(part), _STREAM_CHUNK_CHARS):
+            digest.update(part[pos:pos + _STREAM_CHUNK_CHARS].encode("utf-8", "surrogatepass"))
+        digest.update(b"\x00")
+    return digest.hexdigest()
+
+
+class Rewriter:
+    """GUI-free rewrite engine: prompts, providers and routing, result cache and metrics.
+
+    Without cfg or prompts, config.json and prompts.json are re-read on every
+    call so edits apply without a restart. rewrite() blocks; arewrite() runs it in a worker thread for asyncio.
+    """
+
+    def __init__(self, cfg: Optional[Dict[str, Any]] = None, prompts: Optional[List[Dict[str, str]]] = None):
+        self._cfg = cfg
+        self._prompts = prompts
+        self._cache: "OrderedDict[str, str]" = OrderedDict()
+        # Content-addressed paragraph results for incremental mode
+        self._paragraphs: "OrderedDict[str, str]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._metrics: Dict[str, float] = {
+            "requests": 0,
+            "errors": 0,
+            "cache_hits": 0,
+            "paragraphs_reused": 0,
+            "paragraphs_sent": 0,
+            "edit_replies": 0,
+            "edit_fallbacks": 0,
+            "total_latency_s": 0.0,
+            "last_latency_s": 0.0,
+        }
+
+    def config(self) -> Dict[str, Any]:
+        return self._cfg if self._cfg is not None else load_config()
+
+    def prompts(self) -> List[Dict[str, str]]:
+        return list(self._prompts) if self._prompts is not None else load_prompts()
+
+    def prompt(self, name: str) -> Dict[str, str]:
+        """Look up a quick prompt by name."""
+        for p in self.prompts():
+            if p.get("name") == name:
+                return p
+        raise KeyError(f"No prompt named '{name}'.")
+
+    def rewrite(
+        self,
+        text: str,
+        instruction: Optional[str] = None,
+        *,
+        prompt: Optional[str] = None,
+        provider: Optional[str] = None,
+        incremental: Optional[bool] = None,
+        output: Optional[str] = None,
+        calls: Optional[CallLog] = None,
+    ) -> str:
+        """Rewrite text with a free-form instruction or a named quick prompt.
+
+        In incremental mode (argument, or "incremental" in config.json) text
+        with several paragraphs is rewritten paragraph by paragraph and only
+        paragraphs not seen before with this instruction and model are sent.
+        With output="edits" (or "output": "edits" on the prompt) the model
+        returns only the edits, which are applied here; a malformed edit list
+        falls back to a full rewrite. Every provider call made is added to
+        calls, if given.
+        """
+        if prompt is not None:
+            p = self.prompt(prompt)
+            instruction = p.get("prompt", "")
+            provider = provider or p.get("provider")
+            output = output or p.get("output")
+        instruction = instruction or ""
+        output = output if output in _OUTPUT_SUFFIXES else "text"
+        cfg = self.config()
+
+        max_entries = int((cfg.get("cache") or {}).get("max_entries", DEFAULT_CACHE_ENTRIES))
+        # Large selections aren't cached so the cache can't pin several copies of them in memory
+        key = None
+        if max_entries > 0 and len(text) < STREAM_THRESHOLD_CHARS:
+            key = _text_digest(text, instruction, _model_identity(cfg, provider))
+        if key is not None:
+            with self._lock:
+                cached = self._cache.get(key)
+                if cached is not None:
+                    self._cache.move_to_end(key)
+                    self._metrics["cache_hits"] += 1
+                    return cached
+
+        if incremental is None:
+            incremental = bool((cfg.get("incremental") or {}).get("enabled"))
+        paragraphs = split_paragraphs(text) if incremental else []
+
+        started = time.perf_counter()
+        try:
+            if len(paragraphs) > 1:
+                result = profiler.run(self._rewrite_incremental, paragraphs, instruction, provider, cfg, calls)
+            else:
+                result = profiler.run(self._rewrite_planned, text, instruction, provider, cfg, output, calls)
+        except Exception:
+            with self._lock:
+                self._metrics["requests"] += 1
+                self._metrics["errors"] += 1
+            raise
+        elapsed = time.perf_counter() - started
+
+        with self._lock:
+            self._metrics["requests"] += 1
+            self._metrics["total_latency_s"] += elapsed
+            self._metrics["last_latency_s"] = elapsed
+            if key is not None and len(result) < STREAM_THRESHOLD_CHARS:
+                self._cache[key] = result
+                while len(self._cache) > max_entries:
+                    self._cache.popitem(last=False)
+        return result
+
+    async def arewrite(
+        self,
+        text: str,
+        instruction: Optional[str] = None,
+        *,
+        prompt: Optional[str] = None,
+        provider: Optional[str] = None,
+        incremental: Optional[bool] = None,
+        output: Optional[str] = None,
+        calls: Optional[CallLog] = None,
+    ) -> str:
+        import asyncio
+
+        return await asyncio.to_thread(
+            self.rewrite,
+            text,
+            instruction,
+            prompt=prompt,
+            provider=provider,
+            incremental=incremental,
+            output=output,
+            calls=calls,
+        )
+
+    def _rewrite_planned(
+        self,
+        text: str,
+        instruction: str,
+        provider: Optional[str],
+        cfg: Dict[str, Any],
+        output: str = "text",
+        calls: Optional[CallLog] = None,
+    ) -> str:
+        """Send the request as preflight() decides: as is, to a larger model, in chunks, or not at all."""
+        plan = preflight(text, instruction, provider, cfg)
+        if plan["action"] == "reject":
+            raise InputTooLarge(plan["message"])
+        if plan["action"] == "switch":
+            logger.info("≈%d tokens exceeds the model limit; switching to %s", plan["tokens"], plan["model"])
+            if output == "edits":
+                result = self._rewrite_with_edits(text, instruction, plan["provider"], cfg, calls, plan["model"])
+                if result is not None:
+                    return result
+            return call_openrouter_api(text, instruction, plan["provider"], plan["model"], cfg, calls=calls)
+        if plan["action"] == "chunk":
+            chunks = split_into_chunks(text, plan["chunk_tokens"])
+            logger.info("≈%d tokens exceeds the model limit; sending %d chunks", plan["tokens"], len(chunks))
+            workers = max(1, min(len(chunks), int((cfg.get("preflight") or {}).get("max_workers", 4))))
+            with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="chunk") as pool:
+                rewritten = list(pool.map(lambda c: rewrite_with_routing(c, instruction, provider, cfg, calls=calls), chunks))
+            return "".join(_keep_outer_whitespace(c, r) if c.strip() else c for c, r in zip(chunks, rewritten))
+        if output == "edits":
+            result = self._rewrite_with_edits(text, instruction, provider, cfg, calls)
+            if result is not None:
+                return result
+        return rewrite_with_routing(text, instruction, provider, cfg, calls=calls)
+
+    def _rewrite_with_edits(
+        self,
+        text: str,
+        instruction: str,
+        provider: Optional[str],
+        cfg: Dict[str, Any],
+        calls: Optional[CallLog] = None,
+        model: Optional[str] = None,
+    ) -> Optional[str]:
+        """Ask for an edit list and apply it locally; None means fall back to a full rewrite.
+
+        A model (chosen by preflight) is called directly instead of going through routing.
+        """
+        if model is not None:
+            reply = call_openrouter_api(text, instruction, provider, model, cfg, "edits", calls)
+        else:
+            reply = rewrite_with_routing(text, instruction, provider, cfg, output="edits", calls=calls)
+        edits = parse_edits(reply)
+        result = apply_edits(text, edits) if edits is not None else None
+        with self._lock:
+            if result is None:
+                self._metrics["edit_fallbacks"] += 1
+            else:
+                self._metrics["edit_replies"] += 1
+        if result is None:
+            logger.info("Edit-list reply could not be applied (%d chars); falling back to a full rewrite", len(reply))
+        return result
+
+    def _rewrite_incremental(
+        self,
+        parts: List[str],
+        instruction: str,
+        provider: Optional[str],
+        cfg: Dict[str, Any],
+        calls: Optional[CallLog] = None,
+    ) -> str:
+        """Rewrite only uncached paragraphs and reassemble with the original separators."""
+        inc_cfg = cfg.get("incremental") or {}
+        max_entries = int(inc_cfg.get("max_paragraphs", DEFAULT_PARAGRAPH_CACHE_ENTRIES))
+        model_id = _model_identity(cfg, provider)
+
+        # Even indexes are paragraphs, odd ones the separators between them
+        keys: Dict[int, str] = {}
+        results: Dict[int, str] = {}
+        with self._lock:
+            for i in range(0, len(parts), 2):
+                if not parts[i].strip():
+                    continue
+                key = keys[i] = _text_digest(parts[i].strip(), instruction, model_id)
+                if key in self._paragraphs:
+                    self._paragraphs.move_to_end(key)
+                    results[i] = self._paragraphs[key]
+            self._metrics["paragraphs_reused"] += len(results)
+
+        # Identical paragraphs within one document are sent once
+        todo: Dict[str, str] = {}
+        for i, key in keys.items():
+            if i not in results:
+                todo.setdefault(key, parts[i].strip())
+        if todo:
+            fresh = self._send_paragraphs(list(todo.values()), instruction, provider, cfg, inc_cfg, calls)
+            with self._lock:
+                self._metrics["paragraphs_sent"] += len(todo)
+                for key, rewritten in zip(todo.keys(), fresh):
+                    self._paragraphs[key] = rewritten
+                while len(self._paragraphs) > max(0, max_entries):
+                    self._paragraphs.popitem(last=False)
+            by_key = dict(zip(todo.keys(), fresh))
+            for i, key in keys.items():
+                if i not in results:
+                    results[i] = by_key[key]
+
+        return "".join(
+            _reshape_paragraph(part, results[i]) if i in results else part
+            for i, part in enumerate(parts)
+        )
+
+    def _send_paragraphs(
+        self,
+        paragraphs: List[str],
+        instruction: str,
+        provider: Optional[str],
+        cfg: Dict[str, Any],
+        inc_cfg: Dict[str, Any],
+        calls: Optional[CallLog] = None,
+    ) -> List[str]:
+        """One marker-delimited request for all paragraphs, or one request each if that fails."""
+        if len(paragraphs) > 1 and all(can_batch(p) for p in paragraphs):
+            combined, batch_instruction = pack_batch(paragraphs, instruction)
+        else:
+            combined = batch_instruction = ""
+        # Batch only when the combined request fits the model in one go
+        if combined and preflight(combined, batch_instruction, provider, cfg)["action"] == "send":
+            split = split_batch_reply(
+                rewrite_with_routing(combined, batch_instruction, provider, cfg, calls=calls), len(paragraphs)
+            )
+            if split is not None:
+                return split
+            logger.warning("Batched paragraph reply could not be split; sending %d paragraphs separately", len(paragraphs))
+        workers = max(1, min(len(paragraphs), int(inc_cfg.get("max_workers", 4))))
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="paragraph") as pool:
+            return list(pool.map(lambda p: self._rewrite_planned(p, instruction, provider, cfg, calls=calls), paragraphs))
+
+    def metrics(self) -> Dict[str, float]:
+        """Snapshot of request, error, cache-hit, latency and token counters."""
+        with self._lock:
+            snapshot = dict(self._metrics)
+            snapshot["cache_entries"] = len(self._cache)
+        completed = snapshot["requests"] - snapshot["errors"]
+        snapshot["avg_latency_s"] = snapshot["total_latency_s"] / completed if completed else 0.0
+        # Token usage is process-wide (all Rewriter instances share the providers)
+        usage = usage_stats.snapshot()
+        snapshot["prompt_tokens"] = sum(u["prompt_tokens"] for u in usage.values())
+        snapshot["cached_tokens"] = sum(u["cached_tokens"] for u in usage.values())
+        snapshot["completion_tokens"] = sum(u["completion_tokens"] for u in usage.values())
+        return snapshot
+
+    def clear_cache(self) -> None:
+        with self._lock:
+            self._cache.clear()
+            self._paragraphs.clear()
@@ -0,0 +1,56 @@
+import json
+import os
+import sys
+import threading
+from http.server import ThreadingHTTPServer
+
+import pytest
+
+# Tests import the top-level modules directly, as the app and scripts do
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from replay_traces import MockProviderHandler  # noqa: E402
+
+
+class ChatStub:
+    """OpenAI-compatible /chat/completions stub; reply(payload) gives the assistant content."""
+
+    def __init__(self):
+        self.requests = []
+        self.reply = lambda payload: payload["messages"][-1]["content"]
+        self._server = None
+
+    def config(self, **provider):
+        return {
+            "default_provider": "stub",
+            "providers": {"stub": {"base_url": self.base_url, "model": "stub-model", **provider}},
+            "cache": {"max_entries": 64},
+        }
+
+    @property
+    def base_url(self):
+        return f"http://127.0.0.1:{self._server.server_address[1]}/v1"
+
+
+@pytest.fixture
+def chat_stub():
+    stub = ChatStub()
+
+    class Handler(MockProviderHandler):
+        def do_POST(self):
+            payload = json.loads(self._read_body())
+            stub.requests.append(payload)
+            body = json.dumps({"choices": [{"message": {"content": stub.reply(payload)}}], "usage": {}}).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+    stub._server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=stub._server.serve_forever, daemon=True).start()
+    try:
+        yield stub
+    finally:
+        stub._server.shutdown()
+        stub._server.server_close()
@@ -0,0 +1,101 @@
+"""Edit-list output mode: parsing, applying and the request it sends."""
+
+import pytest
+
+from rewriter_core import Rewriter, _default_prompts, apply_edits, parse_edits
+
+
+def test_parse_edits_accepts_fenced_json():
+    reply = '```json\n[{"old": "teh", "new": "the"}]\n```'
+    assert parse_edits(reply) == [("teh", "the")]
+    assert parse_edits("[]") == []
+
+
+@pytest.mark.parametrize("reply", [
+    "the fixed text",
+    '{"old": "a", "new": "b"}',
+    '[{"old": "", "new": "b"}]',
+    '[{"old": "a"}]',
+    '[["a", "b"]]',
+])
+def test_parse_edits_rejects_malformed(reply):
+    assert parse_edits(reply) is None
+
+
+def test_apply_edits_in_order():
+    text = "teh cat sat on teh mat"
+    assert apply_edits(text, [("teh cat", "the cat"), ("teh mat", "the mat")]) == "the cat sat on the mat"
+
+
+def test_apply_edits_repeated_old_listed_per_occurrence():
+    assert apply_edits("teh a. teh b.", [("teh", "the"), ("teh", "the")]) == "the a. the b."
+
+
+@pytest.mark.parametrize("edits", [
+    [("teh", "the")],
+    [("missing", "x")],
+    [("teh a", "A"), ("a. teh", "B")],
+])
+def test_apply_edits_rejects_ambiguous_or_unplaceable(edits):
+    assert apply_edits("teh a. teh b.", edits) is None
+
+
+def test_apply_edits_accepts_unique_out_of_order_edit():
+    assert apply_edits("one two three", [("three", "3"), ("one", "1")]) == "1 two 3"
+
+
+def test_edits_mode_drops_conflicting_output_sentence(chat_stub):
+    fix_grammar = next(p for p in _default_prompts() if p["name"] == "Fix Grammar")
+    rewriter = Rewriter(cfg=chat_stub.config(), prompts=[{**fix_grammar, "output": "edits"}])
+    chat_stub.reply = lambda payload: '[{"old": "teh", "new": "the"}]'
+
+    assert rewriter.rewrite("teh cat", prompt="Fix Grammar") == "the cat"
+    system = chat_stub.requests[-1]["messages"][0]["content"]
+    system = system if isinstance(system, str) else system[0]["text"]
+    assert "Correct any spelling and grammar mistakes" in system
+    assert "corrected text" not in system
+    assert "JSON array of edits" in system
+
+
+def test_malformed_edit_reply_falls_back_to_full_rewrite(chat_stub):
+    rewriter = Rewriter(cfg=chat_stub.config())
+    replies = iter(["not an edit list", "the cat"])
+    chat_stub.reply = lambda payload: next(replies)
+
+    assert rewriter.rewrite("teh cat", "Fix:", output="edits") == "the cat"
+    assert len(chat_stub.requests) == 2
+    metrics = rewriter.metrics()
+    assert (metrics["edit_replies"], metrics["edit_fallbacks"]) == (0, 1)
+
+
+def _system_text(payload):
+    system = payload["messages"][0]["content"]
+    return system if isinstance(system, str) else system[0]["text"]
+
+
+@pytest.mark.parametrize("template, kept", [
+    ("Reply politely to this email:\n{text}", "Reply politely to this email:"),
+    ("Fix grammar. Return British spelling throughout.\n\n{text}", "Return British spelling throughout."),
+    ("Translate to French. Respond in a formal register.\n\n{text}", "Respond in a formal register."),
+    ("Print numbers as words.\n{text}", "Print numbers as words."),
+])
+def test_edits_mode_keeps_real_instructions(chat_stub, template, kept):
+    rewriter = Rewriter(cfg=chat_stub.config())
+    chat_stub.reply = lambda payload: "[]"
+
+    assert rewriter.rewrite("some text", template, output="edits") == "some text"
+    assert kept in _system_text(chat_stub.requests[-1])
+
+
+def test_edits_mode_survives_a_preflight_switch(chat_stub):
+    cfg = chat_stub.config()
+    cfg["model_limits"] = {"stub-model": {"context": 600}, "big-model": {"context": 100_000}}
+    cfg["preflight"] = {"fallback_models": ["big-model"]}
+    rewriter = Rewriter(cfg=cfg)
+    chat_stub.reply = lambda payload: '[{"old": "teh end", "new": "the end"}]'
+
+    text = "word " * 400 + "teh end"
+    assert rewriter.rewrite(text, "Fix:", output="edits") == "word " * 400 + "the end"
+    assert chat_stub.requests[-1]["model"] == "big-model"
+    assert "JSON array of edits" in _system_text(chat_stub.requests[-1])
+    assert rewriter.metrics()["edit_replies"] == 1
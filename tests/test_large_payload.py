@@ -0,0 +1,138 @@
+"""Peak-memory checks for the large-selection request path."""
+
+import json
+import threading
+import tracemalloc
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+import rewriter_core
+from rewriter_core import (
+    _STREAM_CHUNK_CHARS,
+    STREAM_THRESHOLD_CHARS,
+    _build_messages,
+    _iter_json_body,
+    _prompt_spans,
+    call_openrouter_api,
+)
+
+INPUT_CHARS = 4 * 1024 * 1024
+TEMPLATE = "Fix the grammar of this text. Output only the corrected text:\n\n{text}\n\nThanks."
+
+
+def _selection(n_chars: int) -> str:
+    line = "The quick brown fox jumps over the lazy dog. "
+    return (line * (n_chars // len(line) + 1))[:n_chars]
+
+
+def _peak_bytes(fn, *args):
+    tracemalloc.start()
+    try:
+        tracemalloc.reset_peak()
+        result = fn(*args)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return peak, result
+
+
+class _DiscardingHandler(BaseHTTPRequestHandler):
+    """Chat endpoint that reads the request body in small pieces and replies with a prepared body."""
+
+    reply = b""
+    received = 0
+
+    def do_POST(self) -> None:
+        total = 0
+        if self.headers.get("Transfer-Encoding", "").lower() == "chunked":
+            while True:
+                size = int(self.rfile.readline().split(b";")[0].strip() or b"0", 16)
+                if size == 0:
+                    while self.rfile.readline().strip():
+                        pass
+                    break
+                while size:
+                    piece = self.rfile.read(min(size, 16384))
+                    size -= len(piece)
+                    total += len(piece)
+                self.rfile.readline()
+        else:
+            remaining = int(self.headers.get("Content-Length", 0))
+            while remaining:
+                piece = self.rfile.read(min(remaining, 16384))
+                remaining -= len(piece)
+                total += len(piece)
+        type(self).received = total
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(self.reply)))
+        self.end_headers()
+        self.wfile.write(self.reply)
+
+    def log_message(self, format, *args) -> None:
+        pass
+
+
+@pytest.fixture
+def stub_provider():
+    text = _selection(INPUT_CHARS)
+    # Prepared before measuring so only the client side is counted
+    reply = json.dumps({"choices": [{"message": {"content": text}}], "usage": {}}).encode("utf-8")
+    handler = type("StubHandler", (_DiscardingHandler,), {"reply": reply})
+    server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    cfg = {
+        "default_provider": "stub",
+        "providers": {"stub": {"base_url": f"http://127.0.0.1:{server.server_address[1]}/v1", "model": "stub"}},
+        "max_input_chars": 0,
+    }
+    try:
+        yield cfg, handler, text
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def test_prompt_spans_do_not_copy_the_selection():
+    text = _selection(INPUT_CHARS)
+    peak, spans = _peak_bytes(_prompt_spans, text, TEMPLATE)
+    assert "".join(s[a:b] for s, a, b in spans) == TEMPLATE.format(text=text) + rewriter_core.STRICT_SUFFIX
+    assert peak < 0.05 * INPUT_CHARS
+
+
+def test_streamed_body_stays_small_and_is_valid_json():
+    text = _selection(INPUT_CHARS)
+    messages, spans = _build_messages({"system_message": True}, text, TEMPLATE)
+    payload = {"model": "stub", "messages": messages}
+
+    def drain():
+        size = 0
+        largest = 0
+        for piece in _iter_json_body(payload, spans):
+            size += len(piece)
+            largest = max(largest, len(piece))
+        return size, largest
+
+    peak, (size, largest) = _peak_bytes(drain)
+    assert size > INPUT_CHARS
+    # Bounded by the encoding chunk size, not by the selection
+    assert largest <= 6 * _STREAM_CHUNK_CHARS
+    assert peak <= 8 * _STREAM_CHUNK_CHARS
+
+    body = json.loads(b"".join(_iter_json_body(payload, spans)))
+    assert body["messages"][-1]["content"] == text
+
+
+def test_large_request_peak_is_bounded_by_input_size(stub_provider):
+    cfg, handler, text = stub_provider
+    assert len(text) >= STREAM_THRESHOLD_CHARS
+    # Warm up the pooled session and lazy imports outside the measurement
+    call_openrouter_api("warm up", TEMPLATE, cfg=cfg)
+
+    peak, result = _peak_bytes(call_openrouter_api, text, TEMPLATE, None, None, cfg)
+
+    assert result == text
+    assert handler.received > INPUT_CHARS
+    # At most the decoded reply plus the returned text; the request side adds next to nothing
+    assert peak <= 2.5 * INPUT_CHARS
@@ -0,0 +1,46 @@
+"""Paragraph splitting for incremental re-rewrites."""
+
+import pytest
+
+from rewriter_core import Rewriter, _reshape_paragraph, split_paragraphs
+
+
+@pytest.mark.parametrize("text", [
+    "A.\n\nB.\n\n  C.",
+    "A.\r\n\r\nB.\r\n\r\n  C.",
+    "A.\r\n \t\r\n\r\nB.",
+    "\n\nA.\nstill A.\n\n",
+])
+def test_split_round_trips(text):
+    parts = split_paragraphs(text)
+    assert "".join(parts) == text
+
+
+def test_crlf_text_splits_into_paragraphs():
+    parts = split_paragraphs("A.\r\n\r\nB.\r\n\r\n  C.")
+    assert parts[::2] == ["A.", "B.", "C."]
+    assert parts[1::2] == ["\r\n\r\n", "\r\n\r\n  "]
+
+
+def test_single_line_breaks_stay_in_one_paragraph():
+    assert split_paragraphs("line one\nline two\r\nline three") == ["line one\nline two\r\nline three"]
+
+
+def test_reshape_keeps_whitespace_and_one_paragraph():
+    assert _reshape_paragraph("  a b  ", "X\r\n\r\nY") == "  X\nY  "
+
+
+def test_incremental_reuses_unchanged_crlf_paragraphs(chat_stub):
+    cfg = chat_stub.config()
+    cfg["cache"] = {"max_entries": 0}
+    rewriter = Rewriter(cfg=cfg)
+    chat_stub.reply = lambda payload: payload["messages"][-1]["content"].upper()
+
+    first = rewriter.rewrite("one.\r\n\r\ntwo.\r\n\r\nthree.", "Shout:", incremental=True)
+    assert first == "ONE.\r\n\r\nTWO.\r\n\r\nTHREE."
+    sent = len(chat_stub.requests)
+
+    second = rewriter.rewrite("one.\r\n\r\ntwo, edited.\r\n\r\nthree.", "Shout:", incremental=True)
+    assert second == "ONE.\r\n\r\nTWO, EDITED.\r\n\r\nTHREE."
+    assert rewriter.metrics()["paragraphs_reused"] == 2
+    assert len(chat_stub.requests) == sent + 1
@@ -0,0 +1,61 @@
+"""Local token estimates, preflight plans and chunking."""
+
+import pytest
+
+from rewriter_core import estimate_tokens, preflight, split_into_chunks
+
+
+def _cfg(context, **extra):
+    return {
+        "default_provider": "local",
+        "providers": {"local": {"base_url": "http://127.0.0.1:9/v1", "model": "small"}},
+        "model_limits": {"small": {"context": context}},
+        **extra,
+    }
+
+
+def test_estimate_counts_non_ascii_densely():
+    assert estimate_tokens("abcd" * 100) == 100
+    assert estimate_tokens("漢" * 100) == 100
+
+
+@pytest.mark.parametrize("text", [
+    "漢字かな交じり文" * 1250,
+    "word " * 4000,
+    "Ünïcödé wörds ärë dënsër " * 400,
+    "para one.\n\n" + "漢" * 3000 + "\r\n\r\nlast para.",
+])
+def test_chunks_stay_within_budget_and_round_trip(text):
+    chunks = split_into_chunks(text, 1000)
+    assert "".join(chunks) == text
+    assert all(estimate_tokens(c) <= 1000 for c in chunks)
+
+
+def test_chunks_prefer_paragraph_breaks():
+    text = "\r\n\r\n".join(["a" * 2000] * 4)
+    chunks = split_into_chunks(text, 600)
+    assert [c.strip() for c in chunks] == ["a" * 2000] * 4
+
+
+def test_preflight_sends_small_text():
+    assert preflight("hello", "Fix:", None, _cfg(32768))["action"] == "send"
+
+
+def test_preflight_chunks_when_nothing_fits():
+    plan = preflight("word " * 20000, "Fix:", None, _cfg(8192))
+    assert plan["action"] == "chunk"
+    assert plan["chunk_tokens"] > 0
+
+
+def test_preflight_switches_to_a_larger_model():
+    cfg = _cfg(8192, preflight={"fallback_models": ["big"]})
+    cfg["model_limits"]["big"] = {"context": 1_000_000}
+    plan = preflight("word " * 20000, "Fix:", None, cfg)
+    assert plan["action"] == "switch"
+    assert plan["model"] == "big"
+
+
+def test_preflight_reject_only():
+    plan = preflight("word " * 20000, "Fix:", None, _cfg(8192, preflight={"action": "reject"}))
+    assert plan["action"] == "reject"
+    assert plan["message"]
@@ -0,0 +1,49 @@
+"""On-demand rewrite profiling."""
+
+import threading
+
+from rewriter_core import RewriteProfiler
+
+
+def test_disarmed_profiler_calls_through(tmp_path):
+    profiler = RewriteProfiler(str(tmp_path))
+    assert profiler.run(lambda a, b: a + b, 1, 2) == 3
+    assert not list(tmp_path.iterdir())
+
+
+def test_profiled_run_writes_reports(tmp_path):
+    profiler = RewriteProfiler(str(tmp_path))
+    session = profiler.arm(1)
+    assert profiler.run(sum, [1, 2, 3]) == 6
+    names = {p.name for p in (tmp_path / session).iterdir()}
+    assert {"rewrite-1.prof", "rewrite-1-cprofile.txt", "rewrite-1-tracemalloc.txt", "rewrite-1-stacks.txt"} <= names
+    assert profiler.remaining == 0
+
+
+def test_overlapping_runs_do_not_break_each_other(tmp_path):
+    profiler = RewriteProfiler(str(tmp_path))
+    profiler.arm(2)
+    first_started = threading.Event()
+    release = threading.Event()
+    results = {}
+
+    def slow():
+        first_started.set()
+        release.wait(5)
+        return "slow"
+
+    def run_slow():
+        results["slow"] = profiler.run(slow)
+
+    thread = threading.Thread(target=run_slow)
+    thread.start()
+    assert first_started.wait(5)
+    # Overlaps the profiled run: runs unprofiled and leaves the remaining run armed
+    results["fast"] = profiler.run(lambda: "fast")
+    assert profiler.remaining == 1
+    release.set()
+    thread.join()
+
+    assert results == {"slow": "slow", "fast": "fast"}
+    assert profiler.run(lambda: "next") == "next"
+    assert profiler.remaining == 0
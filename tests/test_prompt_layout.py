@@ -0,0 +1,31 @@
+"""System/user message layout used for provider prefix caching."""
+
+from rewriter_core import STRICT_SUFFIX, _TEXT_SLOT, _build_messages, _system_instructions
+
+
+def test_trailing_placeholder_is_dropped():
+    assert _system_instructions("Fix this:\n\n{text}") == "Fix this:" + STRICT_SUFFIX
+
+
+def test_inner_placeholder_refers_to_user_message():
+    system = _system_instructions("Fix this:\n{text}\nKeep it short.")
+    assert "{text}" not in system
+    assert "Fix this:\n[TEXT]\nKeep it short." in system
+    assert "[TEXT] is the text given in the user message." in system
+
+
+def test_unformattable_template_never_leaks_placeholder():
+    template = 'Reply as JSON like {"fixed": "..."} for:\n{text}\nNo prose.'
+    system = _system_instructions(template)
+    assert "{text}" not in system
+    assert '{"fixed": "..."}' in system
+    assert "[TEXT] is the text given in the user message." in system
+
+    assert _system_instructions('Return {"a": 1} for:\n\n{text}') == 'Return {"a": 1} for:' + STRICT_SUFFIX
+
+
+def test_text_goes_last_in_user_message():
+    messages, spans = _build_messages({"system_message": True}, "hello", "Fix:\n{text}")
+    assert [m["role"] for m in messages] == ["system", "user"]
+    assert messages[-1]["content"] == _TEXT_SLOT
+    assert "".join(s[a:b] for s, a, b in spans) == "hello"
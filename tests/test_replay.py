@@ -0,0 +1,27 @@
+"""Trace replay against the built-in mock provider."""
+
+import pytest
+
+from replay_traces import replay, start_mock_provider
+
+TRACES = [
+    {"gap_s": 0, "input_chars": 300, "instruction_chars": 20, "response_chars": 250},
+    {"gap_s": 0.01, "input_chars": 2000, "instruction_chars": 40, "response_chars": 1800},
+]
+
+
+@pytest.mark.parametrize("engine", ["direct", "rewriter"])
+def test_replay_runs_every_request(engine):
+    server = start_mock_provider(0.0, 1e7)
+    try:
+        base_url = f"http://127.0.0.1:{server.server_address[1]}/v1"
+        summary = replay(TRACES, speed=100, users=3, max_gap=1, base_url=base_url, engine=engine)
+    finally:
+        server.shutdown()
+        server.server_close()
+    assert summary["requests"] == 6
+    assert summary["errors"] == 0
+    if engine == "rewriter":
+        assert summary["rewriter"]["requests"] == 6
+    else:
+        assert "rewriter" not in summary
@@ -0,0 +1,111 @@
+"""Localhost rewrite service: micro-batching and HTTP status codes."""
+
+import threading
+
+import pytest
+import requests
+
+from rewrite_server import MicroBatcher, make_server
+from rewriter_core import Rewriter
+
+
+def _shout(payload):
+    return payload["messages"][-1]["content"].upper()
+
+
+def _rewrite_concurrently(batcher, texts, instruction="Shout:"):
+    results = [None] * len(texts)
+
+    def run(i):
+        results[i] = batcher.rewrite(texts[i], instruction)
+
+    threads = [threading.Thread(target=run, args=(i,)) for i in range(len(texts))]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return results
+
+
+def test_batcher_packs_concurrent_texts_into_one_request(chat_stub):
+    chat_stub.reply = _shout
+    batcher = MicroBatcher(Rewriter(cfg=chat_stub.config()), window_ms=200, max_items=4)
+
+    results = _rewrite_concurrently(batcher, ["one", "two", "three", "four"])
+
+    assert results == ["ONE", "TWO", "THREE", "FOUR"]
+    assert len(chat_stub.requests) == 1
+    assert batcher.stats == {"batches": 1, "batched_items": 4, "fallbacks": 0}
+
+
+def test_batcher_falls_back_when_reply_cannot_be_split(chat_stub):
+    chat_stub.reply = lambda payload: "garbled" if "<<<ITEM" in payload["messages"][-1]["content"] else _shout(payload)
+    batcher = MicroBatcher(Rewriter(cfg=chat_stub.config()), window_ms=200, max_items=3)
+
+    results = _rewrite_concurrently(batcher, ["one", "two", "three"])
+
+    assert results == ["ONE", "TWO", "THREE"]
+    assert len(chat_stub.requests) == 1 + 3
+    assert batcher.stats["fallbacks"] == 1
+
+
+def test_batcher_skips_long_and_edit_mode_texts(chat_stub):
+    chat_stub.reply = lambda payload: "[]" if "JSON array of edits" in str(payload["messages"]) else "ok"
+    batcher = MicroBatcher(Rewriter(cfg=chat_stub.config()), window_ms=200, max_chars=10)
+    assert batcher.rewrite("a much longer text", "Fix:") == "ok"
+    assert batcher.rewrite("teh", "Fix:", output="edits") == "teh"
+    assert batcher.stats["batches"] == 0
+
+
+def _serve(rewriter):
+    server = make_server(rewriter, port=0)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+@pytest.fixture
+def service(chat_stub):
+    cfg = chat_stub.config()
+    cfg["max_input_chars"] = 1000
+    # Only "reject" when text doesn't fit, so oversized requests never reach the stub
+    cfg["model_limits"] = {"stub-model": {"context": 2000}}
+    cfg["preflight"] = {"action": "reject"}
+    server = _serve(Rewriter(cfg=cfg, prompts=[{"name": "Shout", "prompt": "Shout:\n{text}"}]))
+    try:
+        yield f"http://127.0.0.1:{server.server_address[1]}", chat_stub
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def test_rewrite_by_prompt_name(service):
+    url, stub = service
+    stub.reply = _shout
+    response = requests.post(url + "/v1/rewrite", json={"text": "hello", "prompt": "Shout"})
+    assert response.status_code == 200
+    assert response.json() == {"text": "HELLO"}
+
+
+@pytest.mark.parametrize("body, status", [
+    ({"instruction": "Fix:"}, 400),
+    ({"text": "hello"}, 400),
+    ({"text": "hello", "prompt": "Missing"}, 404),
+    # Over max_input_chars
+    ({"text": "x" * 2000, "instruction": "Fix:"}, 413),
+    # Under the cap, but with room for the reply it doesn't fit the model and preflight rejects it
+    ({"text": "\u6f22" * 990, "instruction": "Fix:"}, 413),
+])
+def test_client_errors(service, body, status):
+    url, stub = service
+    response = requests.post(url + "/v1/rewrite", json=body)
+    assert response.status_code == status
+    assert response.json()["error"]
+    assert not stub.requests
+
+
+def test_provider_failure_is_502(service):
+    url, stub = service
+    stub.reply = lambda payload: ""
+    response = requests.post(url + "/v1/rewrite", json={"text": "hello", "instruction": "Fix:"})
+    assert response.status_code == 502
+    assert len(stub.requests) == 1
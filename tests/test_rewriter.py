@@ -0,0 +1,81 @@
+"""Rewriter result cache and the sync/async API."""
+
+import asyncio
+import json
+
+import rewriter_core
+from rewriter_core import STREAM_THRESHOLD_CHARS, CallLog, Rewriter
+
+
+def test_cache_hit_for_same_request(chat_stub):
+    rewriter = Rewriter(cfg=chat_stub.config())
+    assert rewriter.rewrite("hello", "Fix:") == rewriter.rewrite("hello", "Fix:")
+    assert len(chat_stub.requests) == 1
+    assert rewriter.metrics()["cache_hits"] == 1
+
+
+def test_cache_is_keyed_by_model(chat_stub):
+    cfg = chat_stub.config()
+    rewriter = Rewriter(cfg=cfg)
+    chat_stub.reply = lambda payload: payload["model"]
+    assert rewriter.rewrite("hello", "Fix:") == "stub-model"
+    cfg["providers"]["stub"]["model"] = "other-model"
+    assert rewriter.rewrite("hello", "Fix:") == "other-model"
+    assert len(chat_stub.requests) == 2
+
+
+def test_large_selections_are_not_cached(chat_stub):
+    cfg = chat_stub.config()
+    cfg["model_limits"] = {"stub-model": {"context": 1_000_000}}
+    rewriter = Rewriter(cfg=cfg)
+    chat_stub.reply = lambda payload: "ok"
+    text = "word " * (STREAM_THRESHOLD_CHARS // 5 + 1)
+    rewriter.rewrite(text, "Fix:")
+    rewriter.rewrite(text, "Fix:")
+    assert len(chat_stub.requests) == 2
+    assert rewriter.metrics()["cache_hits"] == 0
+
+
+def test_arewrite_accepts_rewrite_options(chat_stub):
+    rewriter = Rewriter(cfg=chat_stub.config())
+    chat_stub.reply = lambda payload: '[{"old": "teh", "new": "the"}]'
+    result = asyncio.run(rewriter.arewrite("teh cat", "Fix:", incremental=False, output="edits"))
+    assert result == "the cat"
+
+
+def test_call_log_covers_chunked_requests(chat_stub):
+    cfg = chat_stub.config()
+    cfg["model_limits"] = {"stub-model": {"context": 4096}}
+    cfg["preflight"] = {"action": "chunk"}
+    rewriter = Rewriter(cfg=cfg)
+    chat_stub.reply = lambda payload: "ok"
+    calls = CallLog()
+
+    rewriter.rewrite("\n\n".join(["word " * 500] * 6), "Fix:", calls=calls)
+
+    summary = calls.summary()
+    assert summary["calls"] == len(chat_stub.requests) > 1
+    assert (summary["provider"], summary["model"]) == ("stub", "stub-model")
+    assert summary["http_ms"] > 0
+
+
+def test_call_log_is_empty_on_cache_hit(chat_stub):
+    rewriter = Rewriter(cfg=chat_stub.config())
+    rewriter.rewrite("hello", "Fix:")
+    calls = CallLog()
+    rewriter.rewrite("hello", "Fix:", calls=calls)
+    assert calls.summary()["calls"] == 0
+    assert calls.summary()["provider"] is None
+
+
+def test_prompt_library_edits_apply_without_restart(tmp_path, monkeypatch):
+    path = tmp_path / "prompts.json"
+    monkeypatch.setattr(rewriter_core, "PROMPTS_PATH", str(path))
+    monkeypatch.setattr(rewriter_core, "_prompts_cache", None)
+    path.write_text(json.dumps([{"name": "A", "prompt": "a {text}"}]))
+    rewriter = Rewriter(cfg={})
+    assert rewriter.prompt("A")["prompt"] == "a {text}"
+
+    path.write_text(json.dumps([{"name": "A", "prompt": "edited {text}"}, {"name": "B", "prompt": "b {text}"}]))
+    assert rewriter.prompt("A")["prompt"] == "edited {text}"
+    assert [p["name"] for p in rewriter.prompts()] == ["A", "B"]
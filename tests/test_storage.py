@@ -0,0 +1,54 @@
+"""config.json / prompts.json persistence with the background writer."""
+
+import json
+import threading
+from collections import Counter
+
+import pytest
+
+import rewriter_core
+
+
+@pytest.fixture
+def config_path(tmp_path, monkeypatch):
+    path = tmp_path / "config.json"
+    monkeypatch.setattr(rewriter_core, "CONFIG_PATH", str(path))
+    monkeypatch.setattr(rewriter_core, "_config_cache", None)
+    monkeypatch.setattr(rewriter_core, "_pending_writes", Counter())
+    return path
+
+
+def test_load_during_pending_async_save_keeps_new_value(config_path):
+    rewriter_core.save_config({"api_key": "old"})
+    gate = threading.Event()
+    rewriter_core.writer.submit(gate.wait)
+    try:
+        rewriter_core.save_config_async({"api_key": "new"})
+        assert json.loads(config_path.read_text())["api_key"] == "old"
+        assert rewriter_core.load_config()["api_key"] == "new"
+        assert rewriter_core.cached_config()["api_key"] == "new"
+    finally:
+        gate.set()
+    rewriter_core.writer.flush()
+    assert json.loads(config_path.read_text())["api_key"] == "new"
+    assert rewriter_core.load_config()["api_key"] == "new"
+
+
+def test_reads_never_see_a_partial_write(config_path):
+    cfg = {"api_key": "sk-test", "providers": {f"p{i}": {"base_url": "x" * 500, "model": "m"} for i in range(200)}}
+    rewriter_core.save_config(cfg)
+    stop = threading.Event()
+
+    def write_repeatedly():
+        while not stop.is_set():
+            rewriter_core._write_config(cfg)
+
+    thread = threading.Thread(target=write_repeatedly)
+    thread.start()
+    try:
+        for _ in range(200):
+            assert rewriter_core.load_config()["api_key"] == "sk-test"
+    finally:
+        stop.set()
+        thread.join()
+    assert not list(config_path.parent.glob("*.tmp"))